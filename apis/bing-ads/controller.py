@@ -40,13 +40,18 @@ class BingAdsController:
         self.authorization_data = None
         self.reporting_service_manager = None
 
-    def auth(self):
-        """Autentica com Bing Ads API."""
+    def create_authentication(self) -> OAuthDesktopMobileAuthCodeGrant:
+        """Troca o refresh token por tokens OAuth (chamada de rede, independente da conta)."""
         authentication = OAuthDesktopMobileAuthCodeGrant(
             client_id=self.client_id,
             client_secret=self.client_secret,
         )
         authentication.request_oauth_tokens_by_refresh_token(self.refresh_token)
+        return authentication
+
+    def auth(self, authentication: OAuthDesktopMobileAuthCodeGrant = None):
+        """Autentica com Bing Ads API. authentication: OAuth já obtido, reaproveitado entre contas/requisições."""
+        authentication = authentication or self.create_authentication()
 
         self.authorization_data = AuthorizationData(
             account_id=self.account_id,
@@ -6,6 +6,7 @@ import sys
 import uuid
 from datetime import datetime, timedelta
 
+from bingads.exceptions import OAuthTokenRequestException
 from flask import Flask, jsonify, request
 from loguru import logger
 
@@ -13,9 +14,14 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 
 from controller import BingAdsController
 from shared.bigquery import BigQuery
+from shared.registry import credential_key, registry
 
 app = Flask(__name__)
 
+OAUTH_TTL = 50 * 60  # access token do Bing vale 60 min
+# erros da API que indicam token OAuth inválido/expirado (demais erros não invalidam o token)
+AUTH_ERROR_CODES = ("AuthenticationTokenExpired", "InvalidCredentials", "InvalidAccessToken")
+
 
 def get_required(payload: dict, key: str):
     if key not in payload or payload[key] is None or payload[key] == "":
@@ -27,6 +33,21 @@ def get_env_int(key: str, default: int) -> int:
     v = os.environ.get(key)
     return int(v) if v else default
 
+def is_auth_error(error: Exception) -> bool:
+    """True se o erro veio do OAuth (refresh falhou) ou de token rejeitado pela API."""
+    if isinstance(error, OAuthTokenRequestException):
+        return True
+    return any(code in str(error) for code in AUTH_ERROR_CODES)
+
+def get_bigquery(project_id: str) -> BigQuery:
+    """BigQuery autenticado via ADC, reaproveitado pela instância enquanto estiver quente."""
+    def create() -> BigQuery:
+        bq = BigQuery(credentials_path=None, project_id=project_id)
+        bq.auth()
+        return bq
+
+    return registry.get("bigquery", project_id, create)
+
 
 def run_job(payload: dict) -> dict:
     req_id = str(uuid.uuid4())
@@ -64,8 +85,10 @@ def run_job(payload: dict) -> dict:
         end_date = end_date_dt.strftime("%Y-%m-%d")
 
     # BigQuery
-    bq = BigQuery(credentials_path=None, project_id=project_id)
-    bq.auth()
+    bq = get_bigquery(project_id)
+
+    # tokens OAuth por credencial, reaproveitados entre contas e requisições até OAUTH_TTL
+    oauth_key = credential_key(client_id, client_secret, refresh_token)
 
     results = []
     for aid in account_ids:
@@ -84,9 +107,15 @@ def run_job(payload: dict) -> dict:
             end_date=end_date,
             report_type=report_type,
         )
-        bing.auth()
-
-        df = bing.request_report_retry(columns=columns)
+        bing.auth(authentication=registry.get("bing_oauth", oauth_key, bing.create_authentication, ttl=OAUTH_TTL))
+
+        try:
+            df = bing.request_report_retry(columns=columns)
+        except Exception as e:
+            # token revogado/expirado: a próxima conta/requisição refaz o OAuth
+            if is_auth_error(e):
+                registry.invalidate("bing_oauth", oauth_key)
+            raise
 
         if df.empty:
             results.append({"account_id": account_id, "inserted_rows": 0})
@@ -38,20 +38,24 @@ class DV360Controller:
         self.credentials = None
         self.service = None
 
-    def auth(self):
-        """Autentica com DV360 API."""
-        self.credentials = Credentials(
+    def create_service(self):
+        """Cria credenciais OAuth e o serviço doubleclickbidmanager (independente do advertiser)."""
+        credentials = Credentials(
             token=None,
             refresh_token=self.refresh_token,
             token_uri="https://oauth2.googleapis.com/token",
             client_id=self.client_id,
             client_secret=self.client_secret,
         )
-        self.service = build(
+        return build(
             "doubleclickbidmanager",
             self.API_VERSION,
-            credentials=self.credentials,
+            credentials=credentials,
         )
+
+    def auth(self, service=None):
+        """Autentica com DV360 API. service: serviço já criado, reaproveitado entre requisições."""
+        self.service = service or self.create_service()
         logger.info(f"DV360 autenticado. Advertiser: {self.advertiser_id}")
 
     def get_default_query_spec(self) -> Dict[str, Any]:
@@ -3,6 +3,7 @@ DV360 -> BigQuery API (Cloud Run)
 """
 import os
 import sys
+import threading
 import uuid
 from datetime import datetime, timedelta
 
@@ -13,6 +14,7 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 
 from controller import DV360Controller
 from shared.bigquery import BigQuery
+from shared.registry import credential_key, registry
 
 app = Flask(__name__)
 
@@ -27,6 +29,15 @@ def get_env_int(key: str, default: int) -> int:
     v = os.environ.get(key)
     return int(v) if v else default
 
+def get_bigquery(project_id: str) -> BigQuery:
+    """BigQuery autenticado via ADC, reaproveitado pela instância enquanto estiver quente."""
+    def create() -> BigQuery:
+        bq = BigQuery(credentials_path=None, project_id=project_id)
+        bq.auth()
+        return bq
+
+    return registry.get("bigquery", project_id, create)
+
 
 def run_job(payload: dict) -> dict:
     req_id = str(uuid.uuid4())
@@ -63,8 +74,10 @@ def run_job(payload: dict) -> dict:
         end_date = end_date_dt.strftime("%Y-%m-%d")
 
     # BigQuery
-    bq = BigQuery(credentials_path=None, project_id=project_id)
-    bq.auth()
+    bq = get_bigquery(project_id)
+
+    # o serviço (httplib2) não é thread-safe: um por credencial e por thread do gunicorn
+    service_key = credential_key(client_id, client_secret, refresh_token, threading.get_ident())
 
     results = []
     for adv_id in advertiser_ids:
@@ -82,9 +95,14 @@ def run_job(payload: dict) -> dict:
             end_date=end_date,
             query_id=query_id,
         )
-        dv360.auth()
-
-        df = dv360.request_report_retry(query_spec=query_spec)
+        dv360.auth(service=registry.get("dv360", service_key, dv360.create_service))
+
+        try:
+            df = dv360.request_report_retry(query_spec=query_spec)
+        except Exception:
+            # token revogado/expirado: a próxima requisição recria o serviço
+            registry.invalidate("dv360", service_key)
+            raise
 
         if df.empty:
             results.append({"advertiser_id": advertiser_id, "inserted_rows": 0})
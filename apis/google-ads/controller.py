@@ -42,9 +42,13 @@ class GoogleAdsController:
         self.client = None
         self.ga_service = None
 
-    def auth(self):
-        """Autentica com Google Ads API."""
-        self.client = GoogleAdsClient.load_from_dict(self.credentials)
+    def create_client(self) -> GoogleAdsClient:
+        """Cria o GoogleAdsClient a partir das credenciais (sem depender do customer)."""
+        return GoogleAdsClient.load_from_dict(self.credentials)
+
+    def auth(self, client: GoogleAdsClient = None):
+        """Autentica com Google Ads API. client: cliente já criado, reaproveitado entre requisições."""
+        self.client = client or self.create_client()
         self.ga_service = self.client.get_service("GoogleAdsService", version=self.API_VERSION)
         logger.info(f"Google Ads autenticado. Customer: {self.customer_id}")
 
@@ -14,6 +14,7 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 
 from controller import GoogleAdsController
 from shared.bigquery import BigQuery
+from shared.registry import credential_key, registry
 
 app = Flask(__name__)
 
@@ -31,6 +32,15 @@ def get_env_int(*keys: str, default: int) -> int:
             return int(v)
     return default
 
+def get_bigquery(project_id: str) -> BigQuery:
+    """BigQuery autenticado via ADC, reaproveitado pela instância enquanto estiver quente."""
+    def create() -> BigQuery:
+        bq = BigQuery(credentials_path=None, project_id=project_id)
+        bq.auth()
+        return bq
+
+    return registry.get("bigquery", project_id, create)
+
 
 def run_job(payload: dict) -> dict:
     req_id = str(uuid.uuid4())
@@ -68,8 +78,10 @@ def run_job(payload: dict) -> dict:
         end_date = end_date_dt.strftime("%Y-%m-%d")
 
     # BigQuery via ADC
-    bq = BigQuery(credentials_path=None, project_id=project_id)
-    bq.auth()
+    bq = get_bigquery(project_id)
+
+    # um GoogleAdsClient por conjunto de credenciais, vivo enquanto a instância estiver quente
+    client_key = credential_key(developer_token, refresh_token, client_id, client_secret, login_customer_id)
 
     results = []
     for cid in customer_ids:
@@ -87,7 +99,7 @@ def run_job(payload: dict) -> dict:
             start_date=start_date,
             end_date=end_date,
         )
-        ga.auth()
+        ga.auth(client=registry.get("google_ads", client_key, ga.create_client))
 
         # Usa query customizada ou padrão
         if custom_query:
@@ -98,7 +110,12 @@ def run_job(payload: dict) -> dict:
         else:
             query = None
 
-        df = ga.request_report_retry(query)
+        try:
+            df = ga.request_report_retry(query)
+        except Exception:
+            # credencial revogada/expirada: a próxima requisição recria o cliente
+            registry.invalidate("google_ads", client_key)
+            raise
 
         if df.empty:
             results.append({"customer_id": customer_id, "inserted_rows": 0})
@@ -0,0 +1,56 @@
+import hashlib
+import threading
+import time
+
+def credential_key(*parts):
+    """Chave estável para um conjunto de credenciais (hash; o segredo não vira chave em memória)."""
+    raw = "\x1f".join("" if part is None else str(part) for part in parts)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+## registro de clientes pesados mantidos vivos enquanto a instância estiver quente
+class ClientRegistry:
+    """
+    Guarda objetos criados sob demanda por (kind, key): clientes BigQuery e Secret Manager,
+    sessão HTTP, rate governor e configuração lida do disco. Cada objeto é criado uma única
+    vez, mesmo com vários workers pedindo a mesma chave, e reaproveitado entre execuções
+    até expirar (ttl) ou ser invalidado (ex.: erro de autenticação).
+    """
+
+    def __init__(self):
+        self._entries = {}        # (kind, key) -> (objeto, expira_em ou None)
+        self._create_locks = {}   # (kind, key) -> lock de criação
+        self._lock = threading.Lock()
+
+    def get(self, kind, key, factory, ttl=None):
+        entry_key = (kind, key)
+        entry = self._entries.get(entry_key)
+        if self._valid(entry):
+            return entry[0]
+
+        with self._lock:
+            create_lock = self._create_locks.setdefault(entry_key, threading.Lock())
+
+        with create_lock:
+            entry = self._entries.get(entry_key)
+            if self._valid(entry):
+                return entry[0]
+
+            print(f"[client_registry] criando '{kind}'")
+            obj = factory()
+            self._entries[entry_key] = (obj, time.time() + ttl if ttl else None)
+            return obj
+
+    def invalidate(self, kind=None, key=None):
+        """Remove objetos do registro; kind/key None = todos."""
+        with self._lock:
+            for entry_key in list(self._entries):
+                if (kind is None or entry_key[0] == kind) and (key is None or entry_key[1] == key):
+                    del self._entries[entry_key]
+                    print(f"[client_registry] '{entry_key[0]}' invalidado")
+
+    @staticmethod
+    def _valid(entry):
+        return entry is not None and (entry[1] is None or entry[1] > time.time())
+
+# registro único do processo
+registry = ClientRegistry()
@@ -1,14 +1,28 @@
+import threading
+import time
+
 from google.cloud import secretmanager
 from loguru import logger
 
+# seconds a secret payload stays cached in the process. Writers in other processes
+# (e.g. the token updater) are only picked up after this, so keep it short
+SECRET_CACHE_TTL = 300
+
+# (project_id, secret_id, version_id) -> (payload, expires_at); module-level, so shared only by the
+# SecretManager objects of this process (each function instance has its own cache)
+_secret_cache = {}
+_secret_cache_lock = threading.Lock()
+
 
 class SecretManager:
     """Class that instantiates Secret Manager client"""
 
     def __init__(
         self,
+        cache_ttl: int = SECRET_CACHE_TTL,
     ):
         self.client = secretmanager.SecretManagerServiceClient()
+        self.cache_ttl = cache_ttl
 
     def update_secret(
         self,
@@ -34,24 +48,59 @@ class SecretManager:
         return True
 
     def access_secret_version(
-        self, secret_id: str, project_id: str, version_id: str = "latest"
+        self,
+        secret_id: str,
+        project_id: str,
+        version_id: str = "latest",
+        use_cache: bool = True,
     ) -> str:
         """Access a secret version.
 
+        Payloads are cached in the process for cache_ttl seconds, so "latest" is
+        resolved at most once per TTL. Writes made through this class
+        (add_secret_version/update_secret/destroy_secret_version) invalidate the cache.
+
         Args:
             secret_id (str): ID of secret
             project_id (str): Project ID where the secret is stored
             version_id (str, optional): Secret version ID. Defaults to "latest".
+            use_cache (bool, optional): Read from the in-process cache. Defaults to True.
 
         Returns:
             str: Secret contents.
         """
         secret_name = f"projects/{project_id}/secrets/{secret_id}/versions/{version_id}"
+        cache_key = (project_id, secret_id, str(version_id))
+
+        if use_cache and self.cache_ttl:
+            with _secret_cache_lock:
+                cached = _secret_cache.get(cache_key)
+            if cached is not None and cached[1] > time.time():
+                logger.debug(f"Secret [{secret_name}] served from cache")
+                return cached[0]
 
         logger.info(f"Retrieving secret [{secret_name}]")
         response = self.client.access_secret_version(name=secret_name)
+        payload = response.payload.data.decode("UTF-8")
+
+        if self.cache_ttl:
+            with _secret_cache_lock:
+                _secret_cache[cache_key] = (payload, time.time() + self.cache_ttl)
 
-        return response.payload.data.decode("UTF-8")
+        return payload
+
+    @staticmethod
+    def invalidate_cache(secret_id: str = None, project_id: str = None) -> None:
+        """Drops cached payloads of a secret (all versions), or the whole cache.
+
+        Args:
+            secret_id (str, optional): ID of secret. Defaults to None (all secrets).
+            project_id (str, optional): Project ID of the secret. Defaults to None (all projects).
+        """
+        with _secret_cache_lock:
+            for key in list(_secret_cache):
+                if (project_id is None or key[0] == project_id) and (secret_id is None or key[1] == secret_id):
+                    del _secret_cache[key]
 
     def get_latest_version_id(self, secret_id: str, project_id: str) -> int:
         """What's the latest version ID.
@@ -95,6 +144,9 @@ class SecretManager:
         new_version = self.client.add_secret_version(request=secret_add_version_request)
         new_version_number = int(new_version.name.split("/")[5])
 
+        # "latest" now points to the new version
+        self.invalidate_cache(secret_id, project_id)
+
         return new_version_number
 
     def destroy_secret_version(
@@ -114,4 +166,5 @@ class SecretManager:
 
         logger.info(f"Destroying secret version [{secret_name}]")
         self.client.destroy_secret_version(request={"name": secret_name})
+        self.invalidate_cache(secret_id, project_id)
         return True
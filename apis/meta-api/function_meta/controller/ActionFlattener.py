@@ -0,0 +1,73 @@
+import re
+import logging as log
+import pandas as pd
+
+# colunas legadas: mantém só o primeiro 'value' da lista, na própria coluna
+FIRST_VALUE_COLUMNS = ['video_play_actions', 'video_thruplay_watched_actions', 'video_p100_watched_actions', 'video_p25_watched_actions']
+
+# colunas lista de {action_type, value} explodidas em uma coluna por action_type
+ACTION_LIST_COLUMNS = ['actions', 'action_values', 'conversions', 'conversion_values', 'cost_per_action_type']
+
+def _explode_actions(series):
+    """
+    Transforma uma coluna de listas de {action_type, value} em um DataFrame longo
+    (action_type, value) indexado pela linha de origem, sem loop Python por linha.
+    """
+    exploded = series.explode().dropna()
+    if exploded.empty:
+        return pd.DataFrame(columns=['action_type', 'value'])
+
+    actions = pd.DataFrame(exploded.tolist(), index=exploded.index)
+    actions = actions.reindex(columns=['action_type', 'value'])
+    actions['value'] = pd.to_numeric(actions['value'], errors='coerce')
+    return actions
+
+def _column_name(prefix, action_type):
+    # nomes de coluna válidos no BigQuery (ex.: offsite_conversion.fb_pixel_lead)
+    return f"{prefix}_{re.sub(r'[^0-9a-zA-Z_]', '_', str(action_type))}"
+
+def first_action_value(df, columns=FIRST_VALUE_COLUMNS):
+    """Substitui cada coluna pelo 'value' (float) do primeiro elemento da lista."""
+    for col in columns:
+        if col not in df.columns:
+            log.warning(f"Coluna {col} não encontrada no DataFrame. Pulando.")
+            continue
+
+        actions = _explode_actions(df[col])
+        first = actions.loc[~actions.index.duplicated(), 'value']
+        df[col] = first.reindex(df.index).astype('float64')
+
+    return df
+
+def flatten_action_columns(df, columns=ACTION_LIST_COLUMNS, action_types=None):
+    """
+    Explode colunas lista de {action_type, value} em colunas largas '<coluna>_<action_type>'
+    (float), somando valores repetidos do mesmo action_type na linha. A coluna original é removida.
+    action_types restringe as colunas geradas (allow-list) e garante que todas existam,
+    mesmo sem dados, para manter o schema estável entre execuções. Sem allow-list o conjunto
+    de colunas varia com os action_types retornados; as cargas no BigQuery (append_parquet,
+    merge_parquet) adicionam as colunas novas ao destino e convertem os tipos para o dele.
+    """
+    for col in columns:
+        if col not in df.columns:
+            continue
+
+        actions = _explode_actions(df[col])
+        if action_types is not None:
+            actions = actions[actions['action_type'].isin(action_types)]
+
+        wide = (
+            actions.groupby([actions.index, 'action_type'])['value']
+            .sum(min_count=1)
+            .unstack('action_type')
+        ) if not actions.empty else pd.DataFrame(index=df.index)
+
+        if action_types is not None:
+            wide = wide.reindex(columns=action_types)
+
+        wide = wide.reindex(df.index).astype('float64')
+        wide.columns = [_column_name(col, t) for t in wide.columns]
+
+        df = pd.concat([df.drop(columns=[col]), wide], axis=1)
+
+    return df
@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta
+
+# totais diários comparados entre a Meta (nível conta) e a tabela de destino
+PROBE_FIELDS = ['spend', 'impressions', 'clicks']
+
+# contagens são comparadas exatamente
+COUNT_FIELDS = ['impressions', 'clicks']
+
+# valores monetários: o total da conta na Meta é comparado com a soma dos valores por ad
+# já arredondados no destino, que diverge alguns centavos por dia mesmo sem mudança;
+# tolera a maior entre a diferença absoluta e a relativa ao total
+TOLERANCE = 0.01
+RELATIVE_TOLERANCE = 0.005
+
+def changed_days(source_totals, destination_totals, fields=PROBE_FIELDS, tolerance=TOLERANCE,
+                 relative_tolerance=RELATIVE_TOLERANCE):
+    """
+    Compara os totais diários {date 'YYYY-MM-DD': {campo: valor}} da Meta com os já
+    carregados no destino e retorna os dias divergentes, ordenados. Dia ausente de um
+    dos lados conta como zero (dia novo na Meta ou dado removido na origem).
+    """
+    changed = []
+    for day in sorted(set(source_totals) | set(destination_totals)):
+        source = source_totals.get(day) or {}
+        destination = destination_totals.get(day) or {}
+        for field in fields:
+            source_value = float(source.get(field) or 0)
+            destination_value = float(destination.get(field) or 0)
+            allowed = 0 if field in COUNT_FIELDS else max(
+                tolerance, relative_tolerance * max(abs(source_value), abs(destination_value)))
+            if abs(source_value - destination_value) > allowed:
+                changed.append(day)
+                break
+    return changed
+
+def contiguous_windows(days):
+    """Agrupa dias 'YYYY-MM-DD' em janelas contíguas [(start_date, end_date), ...]."""
+    windows = []
+    for day in sorted(set(days)):
+        current = datetime.strptime(day, "%Y-%m-%d")
+        if windows and datetime.strptime(windows[-1][1], "%Y-%m-%d") + timedelta(days=1) == current:
+            windows[-1] = (windows[-1][0], day)
+        else:
+            windows.append((day, day))
+    return windows
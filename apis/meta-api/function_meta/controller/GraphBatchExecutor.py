@@ -0,0 +1,113 @@
+import json
+
+GRAPH_URL = "https://graph.facebook.com/v24.0"
+BATCH_SIZE = 50        # limite de sub-requisições por chamada da Batch API
+
+class GraphBatchExecutor:
+    """
+    Agrupa os lookups por id (image_hash, video_id) do enriquecimento de creatives
+    e os resolve em poucas chamadas, em vez de uma requisição por creative:
+    - image_hash -> url: lookup em massa via act_<account_id>/adimages?hashes=[...]
+    - video_id -> thumbnail: Graph Batch API (até BATCH_SIZE sub-requisições por POST)
+    Usa a sessão HTTP do MetaController informado.
+    Ids cujo lookup falhou (erro, throttling, retries esgotados) ficam em failed: a ausência
+    deles no resultado não significa "sem imagem" e não deve ir para o cache.
+    """
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.failed = set()
+
+    def execute(self, relative_urls):
+        """
+        Envia GETs relativos (ex.: "<id>?fields=thumbnails") pela Batch API.
+        Retorna uma lista alinhada com relative_urls contendo o body (dict) de cada
+        sub-requisição, ou None quando ela falhou.
+        """
+        results = []
+        for i in range(0, len(relative_urls), BATCH_SIZE):
+            chunk = relative_urls[i:i + BATCH_SIZE]
+            batch = [{"method": "GET", "relative_url": url} for url in chunk]
+            data = {
+                "access_token": self.controller.access_token,
+                "batch": json.dumps(batch),
+                "include_headers": "false",
+            }
+
+            chunk_results = []
+            try:
+                # o lote só tem GETs: repetir o POST não tem efeito colateral
+                r = self.controller._post(f"{GRAPH_URL}/", data, retry_safe=True)
+                if r.status_code != 200:
+                    print(f"[batch] status {r.status_code}: {r.text}")
+                else:
+                    for item in r.json():
+                        # item None = sub-requisição não processada pela Graph API
+                        if not item or item.get("code") != 200:
+                            chunk_results.append(None)
+                        else:
+                            chunk_results.append(json.loads(item.get("body") or "{}"))
+
+            except Exception as e:
+                print(f"Erro na chamada batch: {e}")
+
+            # mantém o alinhamento com relative_urls mesmo quando o chunk falha
+            chunk_results.extend([None] * (len(chunk) - len(chunk_results)))
+            results.extend(chunk_results)
+
+        return results
+
+    def resolve_image_hashes(self, image_hashes):
+        """Retorna {image_hash: url} usando o lookup em massa de adimages da conta."""
+        image_hashes = list(dict.fromkeys(h for h in image_hashes if h))
+        hash_map = {}
+
+        for i in range(0, len(image_hashes), BATCH_SIZE):
+            chunk = image_hashes[i:i + BATCH_SIZE]
+            url = f"{GRAPH_URL}/act_{self.controller.account_id}/adimages"
+            params = {
+                "access_token": self.controller.access_token,
+                "hashes": json.dumps(chunk),
+                "fields": "hash,url",
+            }
+
+            try:
+                while url:
+                    r = self.controller._get(url, params)
+                    if r.status_code != 200:
+                        print(f"[adimages] status {r.status_code}: {r.text}")
+                        self.failed.update(chunk)
+                        break
+                    js = r.json()
+                    for img in js.get("data", []):
+                        if img.get("hash") and img.get("url"):
+                            hash_map[img["hash"]] = img["url"]
+                    # o link "next" já carrega todos os parâmetros
+                    url = js.get("paging", {}).get("next")
+                    params = None
+
+            except Exception as e:
+                print(f"Erro ao buscar adimages: {e}")
+                self.failed.update(chunk)
+                continue
+
+        return hash_map
+
+    def resolve_video_thumbnails(self, video_ids):
+        """Retorna {video_id: uri} com o thumbnail de maior resolução de cada vídeo."""
+        video_ids = list(dict.fromkeys(v for v in video_ids if v))
+        bodies = self.execute([f"{vid}?fields=thumbnails" for vid in video_ids])
+
+        thumb_map = {}
+        for vid, js in zip(video_ids, bodies):
+            if js is None:
+                self.failed.add(vid)
+                continue
+            thumbs = (js or {}).get("thumbnails", {}).get("data", [])
+            if not thumbs:
+                continue
+            # pega a maior resolução
+            best = max(thumbs, key=lambda x: x.get("width", 0))
+            thumb_map[vid] = best.get("uri")
+
+        return thumb_map
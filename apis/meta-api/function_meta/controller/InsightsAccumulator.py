@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+# métricas devolvidas pela Meta como string numérica (convertidas para float)
+NUMERIC_FIELDS = {
+    'impressions', 'clicks', 'inline_link_clicks', 'unique_clicks', 'unique_inline_link_clicks',
+    'spend', 'cpm', 'cpc', 'ctr', 'cpp', 'reach', 'frequency', 'social_spend',
+    'inline_link_click_ctr', 'cost_per_inline_link_click', 'outbound_clicks_ctr',
+}
+# campos de data (YYYY-MM-DD)
+DATE_FIELDS = {'date_start', 'date_stop'}
+
+class InsightsAccumulator:
+    """
+    Acumula as páginas de insights direto em buffers por coluna: cada página (lista 'data')
+    é distribuída nas colunas assim que chega e o JSON bruto pode ser descartado.
+    A tipagem é feita uma única vez, em to_frame().
+    Com flush_rows/on_flush (modo streaming) o buffer é entregue tipado a on_flush sempre
+    que atinge flush_rows linhas e depois esvaziado, limitando a memória usada.
+    """
+
+    def __init__(self, fields=None, flush_rows=None, on_flush=None):
+        # fields: colunas sempre presentes (os campos pedidos), mesmo que nenhuma linha as traga
+        self.fields = list(fields or [])
+        self.flush_rows = flush_rows
+        self.on_flush = on_flush
+        self.flushed_rows = 0
+        self.clear()
+
+    def add_page(self, records):
+        if not records:
+            return
+
+        # colunas novas são preenchidas com None para as linhas anteriores
+        for record in records:
+            for key in record:
+                if key not in self.columns:
+                    self.columns[key] = [None] * self.rows
+
+        for key, values in self.columns.items():
+            values.extend(record.get(key) for record in records)
+
+        self.rows += len(records)
+
+        if self.flush_rows and self.rows >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        if self.on_flush is not None and self.rows:
+            self.on_flush(self.to_frame())
+            self.flushed_rows += self.rows
+            self.clear()
+
+    def clear(self):
+        self.columns = {field: [] for field in self.fields}
+        self.rows = 0
+
+    def to_frame(self):
+        data = {}
+        for key, values in self.columns.items():
+            if key in NUMERIC_FIELDS:
+                data[key] = pd.to_numeric(np.asarray(values, dtype=object), errors='coerce').astype('float64')
+            elif key in DATE_FIELDS:
+                data[key] = pd.to_datetime(pd.Series(values, dtype=object), format='%Y-%m-%d', errors='coerce').dt.date
+            else:
+                data[key] = values
+        return DataFrame(data)
@@ -1,18 +1,85 @@
 import pandas as pd
 from pandas import DataFrame
 from oauth2client.service_account import ServiceAccountCredentials
-from datetime import datetime
-from requests import get
+from datetime import datetime, timedelta
 from json import load
 import json
+import time
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from controller.ChangeDetector import PROBE_FIELDS
+from controller.GraphBatchExecutor import GraphBatchExecutor
+from controller.InsightsAccumulator import InsightsAccumulator
+from controller.RateGovernor import RateGovernor
+from database.CreativeCache import AD_CREATIVE, CREATIVE_IMAGE, AD_IMAGE_ASSET
 
 DEFAULT_TIMEOUT = 12   # segundos
+INSIGHTS_TIMEOUT = 120 # segundos (consultas de insights são mais lentas)
+INSIGHTS_PAGE_LIMIT = 1000  # linhas por página de insights (menos round trips)
 CHUNK_SIZE = 200       # quantos ids processar por chunk (ajuste se necessário)
+CHUNK_WORKERS = 4      # chunks de enriquecimento consultados em paralelo
+CHUNK_RETRIES = 2      # novas tentativas de um chunk que falhou (1s, 2s...)
+
+# pool de conexões / retry para graph.facebook.com
+POOL_SIZE = 10                          # conexões keep-alive mantidas por host
+RETRY_TOTAL = 3                         # tentativas extras em erro transitório
+RETRY_BACKOFF = 1.0                     # 1s, 2s, 4s...
+RETRY_STATUS = (500, 502, 503, 504)
+THROTTLE_RETRIES = 3                    # novas tentativas após throttling da Meta (erros 4/17/613/80000+)
+
+# sub-janelas (shards) de datas buscadas em paralelo por conta
+SHARD_WORKERS = 3              # sub-janelas simultâneas por conta
+
+# report runs assíncronos (POST /insights -> report_run_id)
+ASYNC_THRESHOLD_DAYS = 14      # janelas acima disso usam report run; None desativa
+ASYNC_POLL_INTERVAL = 5        # segundos entre consultas de status (inicial)
+ASYNC_POLL_MAX_INTERVAL = 60   # teto do backoff entre consultas
+ASYNC_TIMEOUT = 1800           # tempo máximo aguardando um report run
+
+class ReduceDataError(Exception):
+    """A Meta recusou a consulta por volume ("please reduce the amount of data you're asking for")."""
+
+def _is_reduce_data_error(response):
+    try:
+        error = response.json().get('error') or {}
+    except (ValueError, AttributeError):
+        return False
+    return error.get('code') == 1 and 'reduce the amount of data' in str(error.get('message', '')).lower()
+
+# tokens já validados neste processo (instância quente reaproveita entre execuções)
+_validated_tokens = set()
+_validated_tokens_lock = threading.Lock()
+
+def build_session(pool_size=POOL_SIZE):
+    """
+    Cria a sessão HTTP usada em todas as chamadas à Graph API: conexões keep-alive
+    reaproveitadas (pool), gzip e retry com backoff em 5xx / erros de conexão.
+    Só GET é repetido em 5xx e erro de leitura: um POST repetido pode criar um segundo
+    report run. POSTs seguros de repetir usam _post(..., retry_safe=True).
+    Pode ser compartilhada entre controllers (uma por execução).
+    """
+    retry = Retry(
+        total=RETRY_TOTAL,
+        backoff_factor=RETRY_BACKOFF,
+        status_forcelist=RETRY_STATUS,
+        allowed_methods=frozenset(["GET"]),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.headers.update({"Accept-Encoding": "gzip, deflate"})
+    return session
 
 class MetaController:
     
-    def __init__(self, access_token, app_id, app_key_secret, account_id, fields_list, start_date, end_date):
+    def __init__(self, access_token, app_id, app_key_secret, account_id, fields_list, start_date, end_date,
+                 async_threshold_days=ASYNC_THRESHOLD_DAYS, session=None, creative_cache=None, rate_governor=None,
+                 shard_days=None, shard_workers=SHARD_WORKERS):
         self.access_token = access_token
         self.app_id = app_id
         self.app_key_secret = app_key_secret
@@ -20,48 +87,264 @@ class MetaController:
         self.fields_list = fields_list
         self.start_date = start_date
         self.end_date = end_date
+        self.async_threshold_days = async_threshold_days
+        # sub-janelas de shard_days dias (1 = por dia, 7 = por semana); None = janela inteira
+        self.shard_days = shard_days
+        self.shard_workers = shard_workers
+        self.session = session or build_session()
+        # estado de throttling (headers de uso da Meta); compartilhar entre as contas da execução
+        self.rate_governor = rate_governor or RateGovernor()
+        # cache persistente (database.CreativeCache) da resolução de imagens; None desativa
+        self.creative_cache = creative_cache
+
+    def _request(self, method, url, timeout, **kwargs):
+        """
+        Toda chamada à Meta passa por aqui: aguarda o rate governor, executa pela sessão
+        e repassa a resposta ao governor; se a Meta limitou a chamada, tenta de novo
+        após o bloqueio indicado (até THROTTLE_RETRIES vezes).
+        """
+        for attempt in range(THROTTLE_RETRIES + 1):
+            self.rate_governor.before_request(self.account_id)
+            response = self.session.request(method, url, timeout=timeout, **kwargs)
+            if not self.rate_governor.after_response(self.account_id, response):
+                break
+        return response
+
+    def _get(self, url, params=None, timeout=DEFAULT_TIMEOUT):
+        return self._request("GET", url, timeout, params=params)
+
+    def _post(self, url, data=None, timeout=DEFAULT_TIMEOUT, retry_safe=False):
+        """
+        POST sem retry automático da sessão. retry_safe=True (ex.: Batch API só com GETs)
+        repete a chamada em 5xx / erro de conexão com o mesmo backoff do retry da sessão.
+        """
+        if not retry_safe:
+            return self._request("POST", url, timeout, data=data)
+
+        for attempt in range(RETRY_TOTAL + 1):
+            try:
+                response = self._request("POST", url, timeout, data=data)
+                if response.status_code not in RETRY_STATUS or attempt == RETRY_TOTAL:
+                    return response
+                print(f"[post] status {response.status_code}, nova tentativa ({attempt + 1}/{RETRY_TOTAL})")
+            except requests.exceptions.RequestException as e:
+                if attempt == RETRY_TOTAL:
+                    raise
+                print(f"[post] erro {e}, nova tentativa ({attempt + 1}/{RETRY_TOTAL})")
+            time.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+    def _cache_get(self, kind, keys):
+        if self.creative_cache is None:
+            return {}
+        return self.creative_cache.get_many(kind, keys)
+
+    def _cache_set(self, kind, mapping):
+        if self.creative_cache is not None:
+            self.creative_cache.set_many(kind, mapping)
+
+    def _cache_log_stats(self, label):
+        if self.creative_cache is not None:
+            self.creative_cache.log_stats(f"{label} conta {self.account_id}")
 
     def auth(self):
-        params = {
+        """
+        Valida o access token com uma chamada leve (/me?fields=id). O resultado fica em
+        cache por token durante a vida do processo: numa execução multi-contas o token é
+        validado uma única vez (o lock evita que os workers validem em paralelo).
+        """
+        with _validated_tokens_lock:
+            if self.access_token in _validated_tokens:
+                return True
+
+            url = 'https://graph.facebook.com/v24.0/me'
+            response = self._get(url, {'access_token': self.access_token, 'fields': 'id'})
+            if response.status_code == 200:
+                print("Autenticação bem sucedida!")
+                _validated_tokens.add(self.access_token)
+                return True
+            else:
+                print("Autenticação falhou!")
+                raise Exception("Autenticação Falhou: " + response.text)
+                    
+    def is_auth(self):
+        return self.auth()
+    
+    def _insights_params(self, start_date, end_date):
+        return {
             'access_token': self.access_token,
             'fields': self.fields_list,
             'breakdown': 'publisher_platform',
             'level': 'ad',
-            'time_range': f'{{"since": "{self.start_date}", "until": "{self.end_date}"}}',
+            'time_range': f'{{"since": "{start_date}", "until": "{end_date}"}}',
             'time_increment': 1,
-            'status': ['active', 'paused', 'archived']
+            'status': ['active', 'paused', 'deleted', 'archived'],
+            'limit': INSIGHTS_PAGE_LIMIT,
         }
 
+    def _requested_fields(self):
+        # fields_list pode vir como "a, b, c", ["a, b, c"] ou ["a", "b", "c"]
+        items = self.fields_list if isinstance(self.fields_list, (list, tuple)) else [self.fields_list]
+        return [f.strip() for item in items for f in str(item).split(',') if f.strip()]
+
+    def _window_days(self, start_date, end_date):
+        start = datetime.strptime(start_date, "%Y-%m-%d")
+        end = datetime.strptime(end_date, "%Y-%m-%d")
+        return (end - start).days + 1
+
+    def _use_async(self, start_date, end_date):
+        """Janelas maiores que async_threshold_days usam report run assíncrono."""
+        return self.async_threshold_days is not None and self._window_days(start_date, end_date) > self.async_threshold_days
+
+    def _shards(self):
+        """Divide start_date..end_date em sub-janelas de shard_days dias (None = janela inteira)."""
+        if not self.shard_days:
+            return [(self.start_date, self.end_date)]
+
+        start = datetime.strptime(self.start_date, "%Y-%m-%d")
+        end = datetime.strptime(self.end_date, "%Y-%m-%d")
+        shards = []
+        while start <= end:
+            shard_end = min(start + timedelta(days=self.shard_days - 1), end)
+            shards.append((start.strftime("%Y-%m-%d"), shard_end.strftime("%Y-%m-%d")))
+            start = shard_end + timedelta(days=1)
+        return shards or [(self.start_date, self.end_date)]
+
+    def _fetch_window(self, start_date, end_date, accumulator):
+        """Busca os insights de uma janela (síncrono ou report run) entregando as páginas ao accumulator."""
         url = f'https://graph.facebook.com/v24.0/act_{self.account_id}/insights'
-        response = get(url, params)
-        if response.status_code == 200:
-            print("Autenticação bem sucedida!")
-        else:
-            print("Autenticação falhou!")
-            raise Exception("Autenticação Falhou: " + response.text)
-                    
-    def is_auth(self):
-        return self.auth()
-    
+        params = self._insights_params(start_date, end_date)
+
+        if self._use_async(start_date, end_date):
+            print(f"Janela de {self._window_days(start_date, end_date)} dias: usando report run assíncrono para a conta: " + str(self.account_id))
+            report_run_id = self._submit_report_run(url, params)
+            self._wait_report_run(report_run_id)
+            url = f'https://graph.facebook.com/v24.0/{report_run_id}/insights'
+            params = {'access_token': self.access_token, 'limit': INSIGHTS_PAGE_LIMIT}
+
+        return self._page_insights(url, params, accumulator)
+
+    def _fetch_shard(self, start_date, end_date, new_accumulator):
+        """
+        Busca uma sub-janela num accumulator próprio. Se a Meta pedir para reduzir o volume
+        ("please reduce the amount of data"), a sub-janela é dividida ao meio recursivamente,
+        até um dia. Retorna os accumulators em ordem de data.
+        """
+        accumulator = new_accumulator()
+        try:
+            self._fetch_window(start_date, end_date, accumulator)
+            return [accumulator]
+        except ReduceDataError:
+            # no modo streaming, blocos já gravados não podem ser refeitos
+            if start_date == end_date or accumulator.flushed_rows:
+                raise
+
+            start = datetime.strptime(start_date, "%Y-%m-%d")
+            middle = start + timedelta(days=(self._window_days(start_date, end_date) - 1) // 2)
+            middle_date = middle.strftime("%Y-%m-%d")
+            next_date = (middle + timedelta(days=1)).strftime("%Y-%m-%d")
+            print(f"Reduzindo janela {start_date}..{end_date} da conta {self.account_id} para "
+                  f"{start_date}..{middle_date} e {next_date}..{end_date}")
+
+            return (self._fetch_shard(start_date, middle_date, new_accumulator)
+                    + self._fetch_shard(next_date, end_date, new_accumulator))
+
+    def _fetch_insights(self, new_accumulator):
+        """
+        Busca todas as sub-janelas da conta em paralelo (shard_workers threads; o ritmo é
+        controlado pelo rate governor) e retorna os accumulators em ordem de data.
+        """
+        shards = self._shards()
+        if len(shards) == 1:
+            return self._fetch_shard(*shards[0], new_accumulator)
+
+        print(f"Conta {self.account_id}: {len(shards)} sub-janelas de até {self.shard_days} dia(s)")
+        with ThreadPoolExecutor(max_workers=self.shard_workers) as executor:
+            results = list(executor.map(lambda shard: self._fetch_shard(*shard, new_accumulator), shards))
+
+        return [accumulator for shard_accumulators in results for accumulator in shard_accumulators]
+
+    def _finish_frame(self, df, date_loading):
+        # Adicionar colunas adicionais e renomear colunas
+        df.insert(0, 'media_source', 'Meta')
+        df['date_loading'] = date_loading
+        df.rename(columns={'date_start': 'date_reference'}, inplace=True)
+        return df
+
     def request_report(self, df):   
+        # cada página vai direto para os buffers por coluna; o JSON bruto é descartado
+        fields = self._requested_fields()
+        accumulators = self._fetch_insights(lambda: InsightsAccumulator(fields=fields))
+
+        # Criar o DataFrame tipado (um por sub-janela, concatenados em ordem de data)
+        frames = [accumulator.to_frame() for accumulator in accumulators]
+        df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+        self.df = self._finish_frame(df, datetime.now())
+        
+        return self.df
+
+    def request_report_to_parquet(self, sink, transform=None):
+        """
+        Modo streaming: a cada sink.buffer_rows linhas o bloco é finalizado, passa por
+        transform (ex.: achatamento das colunas de actions) e é gravado no ParquetSink.
+        A memória fica limitada ao bloco corrente, independente do tamanho da conta.
+        Retorna o número de linhas gravadas.
+        """
+        date_loading = datetime.now()
+        fields = self._requested_fields()
+
+        def write_block(block):
+            block = self._finish_frame(block, date_loading)
+            if transform is not None:
+                block = transform(block)
+            sink.write(block)
+
+        accumulators = self._fetch_insights(
+            lambda: InsightsAccumulator(fields=fields, flush_rows=sink.buffer_rows, on_flush=write_block))
+        for accumulator in accumulators:
+            accumulator.flush()
+
+        return sink.close()
+
+    def probe_fields(self):
+        """Campos da sonda de mudanças que também são carregados no destino."""
+        requested = self._requested_fields()
+        return [field for field in PROBE_FIELDS if field in requested]
+
+    def request_daily_totals(self, fields):
+        """
+        Sonda barata para detecção de mudanças: totais diários da conta (level=account,
+        sem breakdown, uma linha por dia) na janela start_date..end_date.
+        Retorna {date 'YYYY-MM-DD': {campo: valor}}.
+        """
+        url = f'https://graph.facebook.com/v24.0/act_{self.account_id}/insights'
         params = {
             'access_token': self.access_token,
-            'fields': self.fields_list,
-            'breakdown': 'publisher_platform',
-            'level': 'ad',
+            'fields': ','.join(fields),
+            'level': 'account',
             'time_range': f'{{"since": "{self.start_date}", "until": "{self.end_date}"}}',
             'time_increment': 1,
-            'status': ['active', 'paused', 'deleted', 'archived'],
+            'limit': INSIGHTS_PAGE_LIMIT,
         }
-        
-        responses = []
-        url = f'https://graph.facebook.com/v24.0/act_{self.account_id}/insights'
-        response = get(url, params)
+        accumulator = InsightsAccumulator(fields=['date_start', *fields])
+        self._page_insights(url, params, accumulator)
+
+        df = accumulator.to_frame()
+        df[fields] = df[fields].fillna(0)
+        return {str(row['date_start']): {field: row[field] for field in fields} for row in df.to_dict('records')}
+
+    def _page_insights(self, url, params, accumulator):
+        """
+        Pagina um endpoint de insights (síncrono ou resultado de report run) pelos cursores,
+        entregando o 'data' de cada página ao accumulator. Retorna o total de linhas.
+        """
+        total_rows = 0
+        response = self._get(url, params, timeout=INSIGHTS_TIMEOUT)
         
         if response.status_code == 200:
             response_json = response.json()
             if 'data' in response_json and response_json['data']:
-                responses.append(response_json)
+                accumulator.add_page(response_json['data'])
+                total_rows += len(response_json['data'])
                 print("Dados encontrados para a conta: " + str(self.account_id))
                 
                 while 'paging' in response_json and 'cursors' in response_json['paging']:
@@ -69,15 +352,18 @@ class MetaController:
                     
                     if after_cursor:
                         params['after'] = after_cursor
-                        response = get(url, params)
+                        response = self._get(url, params, timeout=INSIGHTS_TIMEOUT)
                         print('Paginando dados para a conta: ' + str(self.account_id))
                         
                         if response.status_code == 200:
                             response_json = response.json()
-                            responses.append(response_json)
+                            accumulator.add_page(response_json.get('data'))
+                            total_rows += len(response_json.get('data') or [])
                             print("Dados encontrados para a conta: " + str(self.account_id))
                         else:
                             print(response.json())
+                            if _is_reduce_data_error(response):
+                                raise ReduceDataError("Volume de dados excessivo para a conta: " + str(self.account_id))
                             raise Exception("Erro ao buscar dados da conta: " + str(self.account_id))
                     else:
                         print("Não há mais páginas para recuperar.")
@@ -86,20 +372,57 @@ class MetaController:
                 print('Sem dados para a conta: ' + str(self.account_id))
         else:
             print(response.json())
+            if _is_reduce_data_error(response):
+                raise ReduceDataError("Volume de dados excessivo para a conta: " + str(self.account_id))
             raise Exception("Erro ao buscar dados da conta: " + str(self.account_id))
-            
-        # Extrair apenas os valores de dados de cada resposta
-        data_values = [data for response in responses if 'data' in response for data in response['data']]
-        
-        # Criar o DataFrame com os valores dos dados
-        self.df = DataFrame(data_values)
-      
-        # Adicionar colunas adicionais e renomear colunas
-        self.df.insert(0, 'media_source', 'Meta')
-        self.df['date_loading'] = datetime.now()
-        self.df.rename(columns={'date_start': 'date_reference'}, inplace=True)
-        
-        return self.df
+
+        return total_rows
+
+    def _submit_report_run(self, url, params):
+        """Submete a consulta de insights como job assíncrono (POST) e retorna o report_run_id."""
+        response = self._post(url, params)
+        if response.status_code != 200:
+            print(response.json())
+            raise Exception("Erro ao criar report run da conta: " + str(self.account_id))
+
+        report_run_id = response.json().get('report_run_id')
+        if not report_run_id:
+            raise Exception("Report run sem report_run_id para a conta: " + str(self.account_id))
+
+        print(f"Report run {report_run_id} criado para a conta: {self.account_id}")
+        return report_run_id
+
+    def _wait_report_run(self, report_run_id):
+        """
+        Aguarda o report run terminar consultando async_status/async_percent_completion.
+        O intervalo entre consultas cresce (backoff) até ASYNC_POLL_MAX_INTERVAL.
+        """
+        url = f'https://graph.facebook.com/v24.0/{report_run_id}'
+        params = {'access_token': self.access_token, 'fields': 'async_status,async_percent_completion'}
+
+        interval = ASYNC_POLL_INTERVAL
+        waited = 0
+        while waited < ASYNC_TIMEOUT:
+            response = self._get(url, params)
+            if response.status_code != 200:
+                print(response.json())
+                raise Exception(f"Erro ao consultar report run {report_run_id} da conta: {self.account_id}")
+
+            js = response.json()
+            status = js.get('async_status')
+            percent = js.get('async_percent_completion', 0)
+            print(f"Report run {report_run_id} da conta {self.account_id}: {status} ({percent}%)")
+
+            if status == 'Job Completed' and percent == 100:
+                return
+            if status in ('Job Failed', 'Job Skipped'):
+                raise Exception(f"Report run {report_run_id} terminou com status {status} para a conta: {self.account_id}")
+
+            time.sleep(interval)
+            waited += interval
+            interval = min(interval * 2, ASYNC_POLL_MAX_INTERVAL)
+
+        raise Exception(f"Timeout aguardando report run {report_run_id} da conta: {self.account_id}")
 
     def get_image_assets_batch(self, df):
         """
@@ -112,79 +435,93 @@ class MetaController:
             return df
 
         ad_ids = df["ad_id"].dropna().astype(str).unique().tolist()
-        ad_image_map = {}
 
-        for i in range(0, len(ad_ids), CHUNK_SIZE):
-            chunk = ad_ids[i:i + CHUNK_SIZE]
-            url = f"https://graph.facebook.com/v24.0/act_{self.account_id}/insights"
-            params = {
-                "access_token": self.access_token,
-                "level": "ad",
-                "breakdowns": "image_asset",
-                "fields": "ad_id",
-                "time_range": f'{{"since":"{self.start_date}","until":"{self.end_date}"}}',
-                "limit": 1000
-            }
-            filtering = [{"field": "ad.id", "operator": "IN", "value": chunk}]
-            params["filtering"] = json.dumps(filtering)
+        # só ads fora do cache são consultados na Graph API
+        ad_image_map = {ad: url for ad, url in self._cache_get(AD_IMAGE_ASSET, ad_ids).items() if url}
+        cached_ads = set(ad_image_map)
+        ad_ids = [ad for ad in ad_ids if ad not in cached_ads]
 
-            try:
-                r = requests.get(url, params=params, timeout=DEFAULT_TIMEOUT)
-                if r.status_code != 200:
-                    print(f"[image_asset] status {r.status_code}: {r.text}")
-                    continue
-                js = r.json()
-                for rec in js.get("data", []):
-                    ad = str(rec.get("ad_id"))
-                    ia = rec.get("image_asset")
-                    chosen = None
-                    # FORMATO 1: lista de dicts com 'image_url' ou 'url'
-                    if isinstance(ia, list):
-                        for item in ia:
-                            if item.get("image_url"):
-                                chosen = item.get("image_url")
-                                break
-                            if item.get("url"):
-                                chosen = item.get("url")
-                                break
-                    elif isinstance(ia, dict):
-                        chosen = ia.get("image_url") or ia.get("url")
-                    if ad and chosen:
-                        ad_image_map[ad] = chosen
-
-                # paginação básica dentro do chunk (next link)
-                next_url = js.get("paging", {}).get("next")
-                while next_url:
-                    r2 = requests.get(next_url, timeout=DEFAULT_TIMEOUT)
-                    if r2.status_code != 200:
-                        break
-                    js2 = r2.json()
-                    for rec in js2.get("data", []):
-                        ad = str(rec.get("ad_id"))
-                        ia = rec.get("image_asset")
-                        chosen = None
-                        if isinstance(ia, list):
-                            for item in ia:
-                                if item.get("image_url"):
-                                    chosen = item.get("image_url")
-                                    break
-                                if item.get("url"):
-                                    chosen = item.get("url")
-                                    break
-                        elif isinstance(ia, dict):
-                            chosen = ia.get("image_url") or ia.get("url")
-                        if ad and chosen:
-                            ad_image_map[ad] = chosen
-                    next_url = js2.get("paging", {}).get("next")
+        chunks = [ad_ids[i:i + CHUNK_SIZE] for i in range(0, len(ad_ids), CHUNK_SIZE)]
 
-            except Exception as e:
-                print(f"Erro ao obter image_asset chunk: {e}")
-                continue
+        # chunks em paralelo na sessão compartilhada; o ritmo é controlado pelo rate governor
+        failed_ads = 0
+        if chunks:
+            with ThreadPoolExecutor(max_workers=min(CHUNK_WORKERS, len(chunks))) as executor:
+                results = list(executor.map(self._fetch_image_asset_chunk_retry, chunks))
+
+            for chunk, chunk_map in zip(chunks, results):
+                if chunk_map is None:
+                    failed_ads += len(chunk)
+                else:
+                    ad_image_map.update(chunk_map)
+
+        unresolved = sum(1 for ad in ad_ids if ad not in ad_image_map)
+        print(f"[image_asset] conta {self.account_id}: {len(ad_ids) - unresolved}/{len(ad_ids)} ads resolvidos, "
+              f"{unresolved} sem image_asset ({failed_ads} em chunks com falha)")
+
+        # ausência de image_asset depende da janela consultada: só cacheia acertos
+        self._cache_set(AD_IMAGE_ASSET, {ad: url for ad, url in ad_image_map.items() if ad not in cached_ads})
+        self._cache_log_stats("image_asset")
 
         # preencher coluna de forma vetorizada (map)
         df["ad_image_hd"] = df["ad_id"].astype(str).map(ad_image_map)
         return df
 
+    def _parse_image_asset_page(self, js):
+        """Extrai ad_id -> image_asset.image_url (ou url) de uma página do breakdown image_asset."""
+        found = {}
+        for rec in js.get("data", []):
+            ad = str(rec.get("ad_id"))
+            ia = rec.get("image_asset")
+            chosen = None
+            # FORMATO 1: lista de dicts com 'image_url' ou 'url'
+            if isinstance(ia, list):
+                for item in ia:
+                    chosen = item.get("image_url") or item.get("url")
+                    if chosen:
+                        break
+            elif isinstance(ia, dict):
+                chosen = ia.get("image_url") or ia.get("url")
+            if ad and chosen:
+                found[ad] = chosen
+        return found
+
+    def _fetch_image_asset_chunk(self, chunk):
+        """Consulta um chunk de ad_ids, seguindo os links paging.next. Levanta exceção em qualquer falha."""
+        url = f"https://graph.facebook.com/v24.0/act_{self.account_id}/insights"
+        params = {
+            "access_token": self.access_token,
+            "level": "ad",
+            "breakdowns": "image_asset",
+            "fields": "ad_id",
+            "time_range": f'{{"since":"{self.start_date}","until":"{self.end_date}"}}',
+            "limit": 1000,
+            "filtering": json.dumps([{"field": "ad.id", "operator": "IN", "value": chunk}]),
+        }
+
+        found = {}
+        while url:
+            r = self._get(url, params)
+            if r.status_code != 200:
+                raise Exception(f"status {r.status_code}: {r.text}")
+            js = r.json()
+            found.update(self._parse_image_asset_page(js))
+            # o link next já carrega todos os parâmetros
+            url = js.get("paging", {}).get("next")
+            params = None
+        return found
+
+    def _fetch_image_asset_chunk_retry(self, chunk):
+        """Tenta o chunk até CHUNK_RETRIES vezes extras; retorna None se todas falharem."""
+        for attempt in range(CHUNK_RETRIES + 1):
+            try:
+                return self._fetch_image_asset_chunk(chunk)
+            except Exception as e:
+                print(f"[image_asset] erro no chunk de {len(chunk)} ads (tentativa {attempt + 1}/{CHUNK_RETRIES + 1}): {e}")
+                if attempt < CHUNK_RETRIES:
+                    time.sleep(RETRY_BACKOFF * 2 ** attempt)
+        return None
+
     # ---------- B) Fallback: buscar via creatives (assets / child_attachments / video thumbnails) ----------
     def get_hd_from_creatives_batch(self, df):
         """
@@ -198,35 +535,43 @@ class MetaController:
             return df
 
         ad_ids = df["ad_id"].dropna().astype(str).unique().tolist()
-        ad_to_creative = {}
 
-        # 1) ad -> creative (batch)
+        # 1) ad -> creative (cache + batch para os misses)
+        ad_to_creative = self._cache_get(AD_CREATIVE, ad_ids)
+        ad_ids = [ad for ad in ad_ids if ad not in ad_to_creative]
+        resolved_ads = {}
         for i in range(0, len(ad_ids), CHUNK_SIZE):
             chunk = ad_ids[i:i + CHUNK_SIZE]
             ids_param = ",".join(chunk)
             url = "https://graph.facebook.com/v24.0/"
             params = {"ids": ids_param, "fields": "creative", "access_token": self.access_token}
             try:
-                r = requests.get(url, params=params, timeout=DEFAULT_TIMEOUT)
+                r = self._get(url, params)
                 if r.status_code != 200:
                     print("Erro batch ad->creative:", r.status_code, r.text)
                     continue
                 js = r.json()
                 for ad, content in js.items():
                     cid = (content.get("creative") or {}).get("id")
-                    if cid:
-                        ad_to_creative[str(ad)] = str(cid)
+                    resolved_ads[str(ad)] = str(cid) if cid else None
             except Exception as e:
                 print("Erro no batch ad->creative:", e)
                 continue
 
+        self._cache_set(AD_CREATIVE, resolved_ads)
+        ad_to_creative.update(resolved_ads)
+        ad_to_creative = {ad: cid for ad, cid in ad_to_creative.items() if cid}
+
         if not ad_to_creative:
+            self._cache_log_stats("creatives")
             df["ad_image_hd"] = None
             return df
 
-        # 2) creative -> obter melhores imagens (batch)
+        # 2) creative -> candidatos de imagem (url direta, hashes, vídeo) em batch, só para os misses
         creative_ids = list(set(ad_to_creative.values()))
-        creative_image_map = {}
+        cached_images = self._cache_get(CREATIVE_IMAGE, creative_ids)
+        creative_ids = [cid for cid in creative_ids if cid not in cached_images]
+        creative_candidates = {}
         for i in range(0, len(creative_ids), CHUNK_SIZE):
             chunk = creative_ids[i:i + CHUNK_SIZE]
             ids_param = ",".join(chunk)
@@ -237,7 +582,7 @@ class MetaController:
                 "access_token": self.access_token
             }
             try:
-                r = requests.get(url, params=params, timeout=DEFAULT_TIMEOUT)
+                r = self._get(url, params)
                 if r.status_code != 200:
                     print("Erro batch creatives:", r.status_code, r.text)
                     continue
@@ -245,13 +590,13 @@ class MetaController:
                 js = r.json()
 
                 for cid, content in js.items():
-                    best = None
+                    candidate = {}
 
                     # 1️⃣ asset_feed_spec.images (IMAGENS HD DE ESTÁTICOS)
                     afs = content.get("asset_feed_spec") or {}
                     for im in (afs.get("images") or []):
                         if im.get("url"):
-                            best = im.get("url")
+                            candidate["url"] = im.get("url")
                             break
 
                     # 2️⃣ Carrossel (child_attachments → image_url)
@@ -259,66 +604,61 @@ class MetaController:
 
                     # 1) photo_data (foto única ou carrossel foto)
                     photo = oss.get("photo_data") or {}
-                    if photo.get("image_hash"):
-                        best = self._get_image_from_hash(photo["image_hash"])
+                    candidate["photo_hash"] = photo.get("image_hash")
 
                     # 2) child_attachments (funciona para foto ou link)
-                    if not best:
-                        children = oss.get("child_attachments") or []
-                        for child in children:
-                            if child.get("image_hash"):
-                                best = self._get_image_from_hash(child["image_hash"])
-                                break
+                    candidate["child_hash"] = next(
+                        (c["image_hash"] for c in (oss.get("child_attachments") or []) if c.get("image_hash")), None)
 
                     # 3) link_data.child_attachments (carrossel link antigo)
-                    if not best:
-                        link = oss.get("link_data") or {}
-                        for child in (link.get("child_attachments") or []):
-                            if child.get("image_hash"):
-                                best = self._get_image_from_hash(child["image_hash"])
-                                break
-
+                    link = oss.get("link_data") or {}
+                    candidate["link_hash"] = next(
+                        (c["image_hash"] for c in (link.get("child_attachments") or []) if c.get("image_hash")), None)
 
                     # 3️⃣ Vídeos (BEST thumbnail → preview_image_url)
-                    # 4) vídeos → thumbnails HD
-                    if not best:
-                        video_data = oss.get("video_data") or {}
-                        if video_data.get("video_id"):
-                            best = self._get_best_video_thumbnail(video_data["video_id"])
+                    candidate["video_id"] = (oss.get("video_data") or {}).get("video_id")
 
-                    creative_image_map[str(cid)] = best
+                    creative_candidates[str(cid)] = candidate
 
             except Exception as e:
                 print("Erro ao buscar creatives batch:", e)
                 continue
 
+        # 3) resolve hashes/vídeos de todos os creatives de uma vez (adimages + Batch API)
+        executor = GraphBatchExecutor(self)
+        hash_map = executor.resolve_image_hashes(
+            h for c in creative_candidates.values() for h in (c["photo_hash"], c["child_hash"], c["link_hash"]))
 
-        # 3) mapear para df
+        creative_image_map = {}
+        for cid, c in creative_candidates.items():
+            best = c.get("url")
+            # photo_data tem prioridade sobre asset_feed_spec
+            if c["photo_hash"]:
+                best = hash_map.get(c["photo_hash"])
+            if not best and c["child_hash"]:
+                best = hash_map.get(c["child_hash"])
+            if not best and c["link_hash"]:
+                best = hash_map.get(c["link_hash"])
+            creative_image_map[cid] = best
+
+        # 4) vídeos → thumbnails HD, só para quem ainda não tem imagem
+        pending_videos = {cid: c["video_id"] for cid, c in creative_candidates.items()
+                          if not creative_image_map[cid] and c["video_id"]}
+        thumb_map = executor.resolve_video_thumbnails(pending_videos.values())
+        for cid, video_id in pending_videos.items():
+            creative_image_map[cid] = thumb_map.get(video_id)
+
+        # creatives sem imagem também vão para o cache (negativo, TTL menor), mas só quando
+        # todos os lookups do creative responderam: falha transitória não vira "sem imagem"
+        lookup_ids = lambda c: {c["photo_hash"], c["child_hash"], c["link_hash"], c["video_id"]} - {None}
+        self._cache_set(CREATIVE_IMAGE, {
+            cid: image for cid, image in creative_image_map.items()
+            if not lookup_ids(creative_candidates[cid]) & executor.failed
+        })
+        self._cache_log_stats("creatives")
+        creative_image_map.update(cached_images)
+
+        # 5) mapear para df
         df["ad_image_hd"] = df["ad_id"].astype(str).map(lambda a: creative_image_map.get(ad_to_creative.get(a)))
         return df
 
-    def _get_image_from_hash(self, image_hash):
-        url = f"https://graph.facebook.com/v24.0/{image_hash}"
-        params = {
-            "access_token": self.access_token,
-            "fields": "url"
-        }
-        r = requests.get(url, params=params).json()
-        return r.get("url")
-
-    def _get_best_video_thumbnail(self, video_id):
-        url = f"https://graph.facebook.com/v24.0/{video_id}"
-        params = {
-            "access_token": self.access_token,
-            "fields": "thumbnails"
-        }
-        js = requests.get(url, params=params).json()
-        
-        thumbs = js.get("thumbnails", {}).get("data", [])
-        if not thumbs:
-            return None
-        
-        # pega a maior resolução
-        best = max(thumbs, key=lambda x: x.get("width", 0))
-        return best.get("uri")
-
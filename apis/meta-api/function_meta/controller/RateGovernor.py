@@ -0,0 +1,116 @@
+import json
+import threading
+import time
+
+SLOWDOWN_THRESHOLD = 75       # % de uso a partir do qual as chamadas passam a ser espaçadas
+MAX_SLOWDOWN_DELAY = 30       # segundos de espera entre chamadas quando o uso chega a 100%
+DEFAULT_BLOCK_SECONDS = 60    # bloqueio quando a Meta limita sem informar o tempo de recuperação
+MAX_BLOCK_SECONDS = 3600
+
+# códigos de erro de throttling da Marketing API
+THROTTLE_ERROR_CODES = {4, 17, 32, 613, 80000, 80001, 80002, 80003, 80004, 80005, 80006, 80008, 80009, 80014}
+
+APP_KEY = "__app__"
+
+class RateGovernor:
+    """
+    Controla o ritmo das chamadas à Marketing API a partir dos sinais de throttling da Meta:
+    headers X-App-Usage, X-Ad-Account-Usage e X-Business-Use-Case-Usage (lidos após cada resposta)
+    e os códigos de erro 4/17/613/80000+. Mantém o uso (%) por app e por conta; acima de
+    SLOWDOWN_THRESHOLD espaça as chamadas progressivamente e, quando a Meta bloqueia, respeita
+    estimated_time_to_regain_access. Deve ser compartilhado por todos os controllers da execução.
+    """
+
+    def __init__(self, slowdown_threshold=SLOWDOWN_THRESHOLD, max_slowdown_delay=MAX_SLOWDOWN_DELAY):
+        self.slowdown_threshold = slowdown_threshold
+        self.max_slowdown_delay = max_slowdown_delay
+        self.usage = {}           # chave (APP_KEY ou account_id) -> % de uso
+        self.blocked_until = {}   # chave -> timestamp até quando não chamar
+        self._lock = threading.Lock()
+
+    def before_request(self, account_id):
+        """Bloqueia o worker o tempo necessário antes de uma chamada da conta."""
+        keys = (APP_KEY, str(account_id))
+        with self._lock:
+            now = time.time()
+            wait = max([self.blocked_until.get(k, 0) - now for k in keys] + [0])
+            usage = max(self.usage.get(k, 0) for k in keys)
+
+        if usage >= self.slowdown_threshold:
+            # espera cresce quadraticamente entre o limiar e 100%
+            ratio = min((usage - self.slowdown_threshold) / max(100 - self.slowdown_threshold, 1), 1)
+            wait = max(wait, self.max_slowdown_delay * ratio ** 2)
+
+        if wait > 0:
+            print(f"[rate_governor] conta {account_id}: uso {usage:.0f}%, aguardando {wait:.1f}s")
+            time.sleep(wait)
+
+    def after_response(self, account_id, response):
+        """Atualiza o estado com os headers/erro da resposta. Retorna True se a chamada foi limitada."""
+        account_key = str(account_id)
+        headers = response.headers
+
+        app_usage = self._parse(headers.get("X-App-Usage"))
+        account_usage = self._parse(headers.get("X-Ad-Account-Usage"))
+        buc_usage = self._parse(headers.get("X-Business-Use-Case-Usage"))
+
+        with self._lock:
+            if app_usage:
+                self.usage[APP_KEY] = self._max_pct(app_usage)
+
+            # uso da conta = leitura mais recente (maior entre os dois headers desta resposta);
+            # não acumula com respostas anteriores, senão o uso nunca voltaria a cair
+            readings = []
+            if account_usage:
+                readings.append(float(account_usage.get("acc_id_util_pct") or 0))
+                reset = float(account_usage.get("reset_time_duration") or 0)
+                if reset and readings[-1] >= 100:
+                    self._block(account_key, reset)
+
+            if buc_usage:
+                # {business_id: [{type, call_count, total_cputime, total_time, estimated_time_to_regain_access}]}
+                entries = [e for items in buc_usage.values() for e in (items or [])]
+                if entries:
+                    readings.append(max(self._max_pct(e) for e in entries))
+                    regain = max(float(e.get("estimated_time_to_regain_access") or 0) for e in entries)
+                    if regain:
+                        self._block(account_key, regain * 60)
+
+            if readings:
+                self.usage[account_key] = max(readings)
+
+            error_code = self._error_code(response) if response.status_code != 200 else None
+            throttled = error_code in THROTTLE_ERROR_CODES
+            if throttled:
+                # sem estimativa nos headers: bloqueio padrão (erro 4 é limite do app inteiro)
+                key = APP_KEY if error_code == 4 else account_key
+                if self.blocked_until.get(key, 0) <= time.time():
+                    self._block(key, DEFAULT_BLOCK_SECONDS)
+                print(f"[rate_governor] conta {account_id} limitada pela Meta (erro {error_code})")
+
+        return throttled
+
+    def _block(self, key, seconds):
+        seconds = min(seconds, MAX_BLOCK_SECONDS)
+        self.blocked_until[key] = max(self.blocked_until.get(key, 0), time.time() + seconds)
+
+    @staticmethod
+    def _parse(value):
+        if not value:
+            return None
+        try:
+            return json.loads(value)
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _max_pct(usage):
+        return max(float(usage.get(k) or 0) for k in ("call_count", "total_cputime", "total_time"))
+
+    @staticmethod
+    def _error_code(response):
+        try:
+            js = response.json()
+        except ValueError:
+            return None
+        return (js.get("error") or {}).get("code") if isinstance(js, dict) else None
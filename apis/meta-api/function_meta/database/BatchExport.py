@@ -0,0 +1,96 @@
+import threading
+import pyarrow as pa
+import pyarrow.parquet as pq
+from database.ParquetSink import ParquetSink, DEFAULT_BUFFER_ROWS
+
+## lote de carga de uma execução: todas as contas vão para o BigQuery num número constante de jobs
+class BatchExport:
+    """
+    Recebe o Parquet extraído de cada conta (add) e, ao final da execução (load), junta todos
+    num único arquivo e faz uma só carga: DELETE escopado por account_id in unnest(@accounts)
+    + load (delete_insert) ou staging + MERGE (merge). Só contas adicionadas com sucesso entram
+    no escopo; os arquivos de contas que falharam nunca chegam ao lote.
+    """
+
+    def __init__(self, bq, start_date, end_date, destination_table, project_id, if_exists,
+                 load_mode="delete_insert", buffer_rows=DEFAULT_BUFFER_ROWS):
+        self.bq = bq
+        self.start_date = start_date
+        self.end_date = end_date
+        self.destination_table = destination_table
+        self.project_id = project_id
+        self.if_exists = if_exists
+        self.load_mode = load_mode
+        self.buffer_rows = buffer_rows
+        self.sinks = {}    # account_id -> ParquetSink fechado da conta
+        self._lock = threading.Lock()
+
+    def add(self, account_id, sink):
+        sink.close()
+        with self._lock:
+            self.sinks[str(account_id)] = sink
+
+    def load(self):
+        """Carrega o lote inteiro. Retorna as linhas carregadas."""
+        with self._lock:
+            accounts = list(self.sinks)
+            paths = [sink.path for sink in self.sinks.values() if sink.rows]
+
+        if not accounts:
+            return 0
+
+        print(f"[batch] carregando {len(accounts)} conta(s) num único lote ({len(paths)} com dados)")
+        if not paths:
+            # nenhuma conta com dados na janela: só remove o que havia no destino
+            self.bq.delete_window(self.start_date, self.end_date, self.destination_table, self.project_id, accounts)
+            return 0
+
+        combined = ParquetSink(buffer_rows=self.buffer_rows, schema=self._union_schema(paths))
+        try:
+            # um row group por vez: a memória fica limitada ao maior row group das contas
+            for path in paths:
+                parquet_file = pq.ParquetFile(path)
+                for i in range(parquet_file.num_row_groups):
+                    combined.write(parquet_file.read_row_group(i))
+            combined.close()
+
+            if self.load_mode == "merge":
+                return self.bq.merge_parquet(combined.path, self.start_date, self.end_date,
+                                             self.destination_table, self.project_id, accounts)
+            return self.bq.load_parquet_window(combined.path, self.start_date, self.end_date,
+                                               self.destination_table, self.project_id, self.if_exists, accounts)
+        finally:
+            combined.remove()
+
+    def remove(self):
+        with self._lock:
+            for sink in self.sinks.values():
+                sink.remove()
+            self.sinks = {}
+
+    @staticmethod
+    def _union_schema(paths):
+        """
+        União das colunas de todos os arquivos, na ordem em que aparecem. Em conflito de tipo
+        vale o tipo diferente de string (colunas só com nulos são gravadas como string); dois
+        tipos numéricos diferentes viram float64 e qualquer outro conflito vira string, para que
+        uma conta com uma coluna de outro tipo não derrube a carga do lote inteiro (a carga
+        converte para o tipo do destino).
+        """
+        fields = {}
+        for path in paths:
+            for field in pq.read_schema(path).remove_metadata():
+                current = fields.get(field.name)
+                if current is None or pa.types.is_string(current.type):
+                    fields[field.name] = field
+                elif pa.types.is_string(field.type) or field.type == current.type:
+                    continue
+                elif _is_numeric(current.type) and _is_numeric(field.type):
+                    fields[field.name] = current.with_type(pa.float64())
+                else:
+                    fields[field.name] = current.with_type(pa.string())
+        return pa.schema(list(fields.values()))
+
+
+def _is_numeric(data_type):
+    return pa.types.is_integer(data_type) or pa.types.is_floating(data_type)
@@ -1,8 +1,18 @@
+import uuid
+from datetime import datetime, timedelta, timezone
 from google.cloud import bigquery
 from google.cloud.bigquery import Table
+from google.api_core.exceptions import NotFound
 from google.oauth2 import service_account
 from pandas.io import gbq
 import pandas_gbq
+from database.ParquetSink import ParquetSink
+
+# chave natural de uma linha de insights no destino (modo merge)
+MERGE_KEYS = ['account_id', 'date_reference', 'ad_id', 'publisher_platform']
+STAGING_EXPIRATION_HOURS = 24   # staging órfã (execução interrompida) expira sozinha
+# nomes legados do schema (API de tabelas) -> tipo do GoogleSQL usado no CAST
+SQL_TYPES = {'FLOAT': 'FLOAT64', 'INTEGER': 'INT64', 'BOOLEAN': 'BOOL'}
 
 ## classe responsável por efetuar a comunicação com o banco de dados BigQuery
 class BigQuery:
@@ -29,6 +39,30 @@ class BigQuery:
         query_job = self.client.query(sql)
         return query_job.result()
 
+    def daily_totals(self, destination_table, project_id, account_id, start_date, end_date, fields):
+        """
+        Totais diários já carregados da conta no destino, para a detecção de mudanças.
+        Retorna {date 'YYYY-MM-DD': {campo: valor}}; tabela inexistente = sem dados.
+        """
+        sums = ", ".join(f"sum(cast({field} as float64)) as {field}" for field in fields)
+        sql = f"""
+            select cast(date_reference as string) as date_reference, {sums}
+            from `{project_id}.{destination_table}`
+            where cast(account_id as string) = @account_id
+                and cast(date_reference as string) between @start_date and @end_date
+            group by 1
+        """
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ScalarQueryParameter("account_id", "STRING", str(account_id)),
+            bigquery.ScalarQueryParameter("start_date", "STRING", start_date),
+            bigquery.ScalarQueryParameter("end_date", "STRING", end_date),
+        ])
+        try:
+            rows = self.client.query(sql, job_config=job_config).result()
+        except NotFound:
+            return {}
+        return {row["date_reference"]: {field: row[field] or 0 for field in fields} for row in rows}
+
     def export(self, df, start_date, end_date, destination_table, project_id, if_exists, account_id):
         
         print(f"deletando histórico start_date: {start_date}, end_date: {end_date}, project_id: {project_id}, destination_table: {destination_table}, account_id: {account_id}")
@@ -37,6 +71,205 @@ class BigQuery:
         self.delete(sql)
 
         print(f"inserindo histórico start_date: {start_date}, end_date: {end_date}, project_id: {project_id}, destination_table: {destination_table} ")
-        pandas_gbq.to_gbq(df, destination_table=destination_table, project_id=project_id, if_exists=if_exists, credentials=self.credentials)
+        if if_exists == "replace":
+            pandas_gbq.to_gbq(df, destination_table=destination_table, project_id=project_id, if_exists=if_exists, credentials=self.credentials)
+            return len(df.index)
+
+        # append: o frame tipado (métricas float, date_reference DATE) é convertido para o schema do destino
+        sink = ParquetSink()
+        try:
+            sink.write(df)
+            if not sink.close():
+                return 0
+            return self.append_parquet(sink.path, f"{project_id}.{destination_table}")
+        finally:
+            sink.remove()
+
+    def export_parquet(self, parquet_path, start_date, end_date, destination_table, project_id, if_exists, account_id):
+        """Carrega um arquivo Parquet local (modo streaming) direto no BigQuery, sem passar por DataFrame."""
+
+        print(f"deletando histórico start_date: {start_date}, end_date: {end_date}, project_id: {project_id}, destination_table: {destination_table}, account_id: {account_id}")
+        
+        sql = f"delete from {project_id}.{destination_table} where date_reference >= '{start_date}' and date_reference <= '{end_date}' and account_id = '{account_id}'"
+        self.delete(sql)
+
+        print(f"carregando parquet {parquet_path} em {project_id}.{destination_table}")
+        if if_exists == "replace":
+            return self._load_parquet(parquet_path, f"{project_id}.{destination_table}", bigquery.WriteDisposition.WRITE_TRUNCATE)
+
+        # colunas de action_type novas e métricas/video_* tipadas seguem o schema do destino
+        return self.append_parquet(parquet_path, f"{project_id}.{destination_table}")
+
+    def _window_params(self, start_date, end_date, account_ids):
+        return [
+            bigquery.ArrayQueryParameter("accounts", "STRING", [str(account_id) for account_id in account_ids]),
+            bigquery.ScalarQueryParameter("start_date", "STRING", start_date),
+            bigquery.ScalarQueryParameter("end_date", "STRING", end_date),
+        ]
+
+    def delete_window(self, start_date, end_date, destination_table, project_id, account_ids):
+        """DELETE parametrizado da janela das contas, num único job (tabela inexistente é ignorada)."""
+        sql = f"""
+            delete from `{project_id}.{destination_table}`
+            where cast(account_id as string) in unnest(@accounts)
+                and cast(date_reference as string) between @start_date and @end_date
+        """
+        job_config = bigquery.QueryJobConfig(query_parameters=self._window_params(start_date, end_date, account_ids))
+        try:
+            self.client.query(sql, job_config=job_config).result()
+        except NotFound:
+            pass
+
+    def merge(self, df, start_date, end_date, destination_table, project_id, account_id):
+        """Modo merge a partir de um DataFrame: grava o frame em Parquet local e chama merge_parquet."""
+        sink = ParquetSink()
+        try:
+            sink.write(df)
+            if not sink.close():
+                # janela sem dados na origem: só remove o que havia no destino
+                self.delete_window(start_date, end_date, destination_table, project_id, [account_id])
+                return 0
+            return self.merge_parquet(sink.path, start_date, end_date, destination_table, project_id, [account_id])
+        finally:
+            sink.remove()
+
+    def merge_parquet(self, parquet_path, start_date, end_date, destination_table, project_id, account_ids):
+        """
+        Carrega o Parquet numa tabela de staging da execução e aplica um único MERGE atômico
+        no destino, chaveado por MERGE_KEYS: linhas existentes são atualizadas, novas inseridas
+        e as das contas/janela que sumiram da origem removidas. Não há intervalo sem dados
+        (como no DELETE + insert) e a SQL é parametrizada. A staging é removida ao final.
+        """
+        destination_id = f"{project_id}.{destination_table}"
+        staging_id = f"{destination_id}__staging_{uuid.uuid4().hex[:12]}"
+
+        try:
+            destination = self.client.get_table(destination_id)
+        except NotFound:
+            # primeira carga: não há o que mesclar, o Parquet cria o destino
+            print(f"tabela {destination_id} inexistente, carregando parquet direto")
+            return self._load_parquet(parquet_path, destination_id, bigquery.WriteDisposition.WRITE_APPEND)
+
+        try:
+            staging, rows = self._load_staging(parquet_path, staging_id)
+            self._add_missing_columns(destination, staging.schema)
+
+            columns = [field.name for field in staging.schema]
+            keys = [key for key in MERGE_KEYS if key in columns]
+            updates = [column for column in columns if column not in keys]
+            source = self._source_columns(staging.schema, destination.schema)
+
+            on = " and ".join(f"T.`{key}` is not distinct from {source[key]}" for key in keys)
+            update_set = ", ".join(f"`{column}` = {source[column]}" for column in updates)
+            insert_columns = ", ".join(f"`{column}`" for column in columns)
+            insert_values = ", ".join(source[column] for column in columns)
+
+            sql = f"""
+                merge `{destination_id}` T
+                using `{staging_id}` S
+                on {on}
+                {f"when matched then update set {update_set}" if updates else ""}
+                when not matched by target then insert ({insert_columns}) values ({insert_values})
+                when not matched by source
+                    and cast(T.account_id as string) in unnest(@accounts)
+                    and cast(T.date_reference as string) between @start_date and @end_date
+                    then delete
+            """
+            job_config = bigquery.QueryJobConfig(query_parameters=self._window_params(start_date, end_date, account_ids))
+
+            print(f"merge start_date: {start_date}, end_date: {end_date}, destination_table: {destination_id}, accounts: {list(account_ids)}")
+            self.client.query(sql, job_config=job_config).result()
+            return rows
+        finally:
+            self.client.delete_table(staging_id, not_found_ok=True)
+
+    def load_parquet_window(self, parquet_path, start_date, end_date, destination_table, project_id, if_exists, account_ids):
+        """DELETE da janela de todas as contas + uma única carga do Parquet (nº de jobs constante, qualquer que seja o nº de contas)."""
+        destination_id = f"{project_id}.{destination_table}"
+        print(f"deletando histórico start_date: {start_date}, end_date: {end_date}, destination_table: {destination_id}, accounts: {list(account_ids)}")
+        self.delete_window(start_date, end_date, destination_table, project_id, account_ids)
+
+        print(f"carregando parquet {parquet_path} em {destination_id}")
+        if if_exists == "replace":
+            return self._load_parquet(parquet_path, destination_id, bigquery.WriteDisposition.WRITE_TRUNCATE)
+        return self.append_parquet(parquet_path, destination_id)
+
+    def append_parquet(self, parquet_path, destination_id):
+        """
+        Append do Parquet no destino respeitando o schema dele: o arquivo vai para uma staging,
+        colunas novas (ex.: novos action_types) são adicionadas ao destino e o insert converte
+        cada coluna para o tipo do destino (destinos antigos têm métricas/date_reference STRING).
+        Tabela inexistente é criada pela carga direta do Parquet.
+        """
+        try:
+            destination = self.client.get_table(destination_id)
+        except NotFound:
+            print(f"tabela {destination_id} inexistente, carregando parquet direto")
+            return self._load_parquet(parquet_path, destination_id, bigquery.WriteDisposition.WRITE_APPEND)
+
+        staging_id = f"{destination_id}__staging_{uuid.uuid4().hex[:12]}"
+        try:
+            staging, rows = self._load_staging(parquet_path, staging_id)
+            self._add_missing_columns(destination, staging.schema)
+
+            columns = [field.name for field in staging.schema]
+            source = self._source_columns(staging.schema, destination.schema)
+            sql = f"""
+                insert into `{destination_id}` ({", ".join(f"`{column}`" for column in columns)})
+                select {", ".join(source[column] for column in columns)}
+                from `{staging_id}` S
+            """
+            print(f"inserindo {rows} linha(s) da staging {staging_id} em {destination_id}")
+            self.client.query(sql).result()
+            return rows
+        finally:
+            self.client.delete_table(staging_id, not_found_ok=True)
+
+    def _load_staging(self, parquet_path, staging_id):
+        """Carrega o Parquet numa staging da execução, que expira sozinha se a execução for interrompida."""
+        print(f"carregando parquet {parquet_path} na staging {staging_id}")
+        rows = self._load_parquet(parquet_path, staging_id, bigquery.WriteDisposition.WRITE_TRUNCATE)
+
+        staging = self.client.get_table(staging_id)
+        staging.expires = datetime.now(timezone.utc) + timedelta(hours=STAGING_EXPIRATION_HOURS)
+        self.client.update_table(staging, ["expires"])
+        return staging, rows
+
+    def _load_parquet(self, parquet_path, table_id, write_disposition):
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.PARQUET,
+            write_disposition=write_disposition,
+        )
+        with open(parquet_path, "rb") as f:
+            job = self.client.load_table_from_file(f, table_id, job_config=job_config)
+        job.result()
+        return job.output_rows
+
+    @staticmethod
+    def _source_columns(staging_schema, destination_schema):
+        """
+        Expressão de cada coluna da staging no MERGE/insert, convertida para o tipo do destino quando
+        difere (ex.: destinos antigos criados pelo pandas_gbq com date_reference/métricas STRING,
+        enquanto o Parquet chega com DATE/FLOAT).
+        """
+        destination_types = {field.name: field.field_type for field in destination_schema}
+        expressions = {}
+        for field in staging_schema:
+            column = f"S.`{field.name}`"
+            source_type = SQL_TYPES.get(field.field_type, field.field_type)
+            target_type = SQL_TYPES.get(destination_types.get(field.name), destination_types.get(field.name))
+            if target_type and target_type != source_type and target_type not in ('RECORD', 'STRUCT'):
+                column = f"cast({column} as {target_type})"
+            expressions[field.name] = column
+        return expressions
 
-        return len(df.index)  
\ No newline at end of file
+    def _add_missing_columns(self, destination, schema):
+        """Colunas novas da staging (ex.: novos action_types) são adicionadas ao destino como NULLABLE."""
+        existing = {field.name for field in destination.schema}
+        missing = [field for field in schema if field.name not in existing]
+        if missing:
+            print(f"adicionando colunas em {destination.full_table_id}: {[field.name for field in missing]}")
+            destination.schema = list(destination.schema) + [
+                bigquery.SchemaField(field.name, field.field_type, mode="NULLABLE") for field in missing
+            ]
+            self.client.update_table(destination, ["schema"])
@@ -0,0 +1,150 @@
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+import threading
+import time
+from datetime import datetime, timezone
+from google.cloud import bigquery
+
+DEFAULT_TTL = 7 * 24 * 3600          # segundos que uma entrada resolvida permanece válida
+DEFAULT_NEGATIVE_TTL = 24 * 3600     # creatives sem imagem são rechecados com mais frequência
+DEFAULT_SQLITE_PATH = os.path.join("/tmp", "meta_creative_cache.sqlite")
+
+# tipos de chave armazenados no cache
+AD_CREATIVE = "ad_creative"          # ad_id -> creative_id
+CREATIVE_IMAGE = "creative_image"    # creative_id -> melhor url de imagem
+AD_IMAGE_ASSET = "ad_image_asset"    # ad_id -> image_asset.image_url
+
+## cache persistente da resolução ad -> creative -> imagem HD, com TTL por entrada
+class CreativeCache(ABC):
+    """
+    Interface comum dos caches de creatives. Implementações guardam (kind, key) -> value
+    com expiração; value None é um cache negativo (creative sem imagem) e usa negative_ttl.
+    get_many retorna só as chaves encontradas e válidas; as ausentes são os misses.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def get_many(self, kind, keys):
+        keys = list(dict.fromkeys(str(k) for k in keys))
+        found = self._read(kind, keys) if keys else {}
+        with self._stats_lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, kind, mapping):
+        if not mapping:
+            return
+        now = time.time()
+        rows = [
+            (str(key), value, now + (self.ttl if value is not None else self.negative_ttl))
+            for key, value in mapping.items()
+        ]
+        self._write(kind, rows)
+
+    def log_stats(self, label=""):
+        with self._stats_lock:
+            total = self.hits + self.misses
+            ratio = (self.hits / total * 100) if total else 0
+            print(f"[creative_cache] {label} hits: {self.hits}, misses: {self.misses} ({ratio:.1f}% hit)")
+
+    @abstractmethod
+    def _read(self, kind, keys):
+        """Retorna {key: value} das chaves encontradas e não expiradas."""
+
+    @abstractmethod
+    def _write(self, kind, rows):
+        """Grava as linhas (key, value, expires_at epoch)."""
+
+
+class SqliteCreativeCache(CreativeCache):
+    """Cache em arquivo SQLite local (sobrevive entre execuções na mesma instância)."""
+
+    def __init__(self, path=DEFAULT_SQLITE_PATH, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL):
+        super().__init__(ttl, negative_ttl)
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "create table if not exists creative_cache ("
+            " kind text not null, cache_key text not null, value text, expires_at real not null,"
+            " primary key (kind, cache_key))"
+        )
+        self.conn.commit()
+
+    def _read(self, kind, keys):
+        found = {}
+        now = time.time()
+        with self._lock:
+            # sqlite limita o número de parâmetros por statement
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.conn.execute(
+                    f"select cache_key, value from creative_cache"
+                    f" where kind = ? and expires_at > ? and cache_key in ({placeholders})",
+                    [kind, now, *chunk],
+                ).fetchall()
+                found.update(dict(rows))
+        return found
+
+    def _write(self, kind, rows):
+        with self._lock:
+            self.conn.executemany(
+                "insert or replace into creative_cache (kind, cache_key, value, expires_at) values (?, ?, ?, ?)",
+                [(kind, key, value, expires_at) for key, value, expires_at in rows],
+            )
+            self.conn.commit()
+
+
+class BigQueryCreativeCache(CreativeCache):
+    """
+    Cache em tabela BigQuery (compartilhado entre instâncias). A tabela é append-only:
+    a leitura considera só a entrada mais recente de cada chave ainda não expirada.
+    """
+
+    def __init__(self, client, table_id, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL):
+        super().__init__(ttl, negative_ttl)
+        self.client = client
+        self.table_id = table_id
+        schema = [
+            bigquery.SchemaField("kind", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("cache_key", "STRING", mode="REQUIRED"),
+            bigquery.SchemaField("value", "STRING"),
+            bigquery.SchemaField("expires_at", "TIMESTAMP", mode="REQUIRED"),
+            bigquery.SchemaField("written_at", "TIMESTAMP", mode="REQUIRED"),
+        ]
+        self.client.create_table(bigquery.Table(table_id, schema=schema), exists_ok=True)
+
+    def _read(self, kind, keys):
+        sql = f"""
+            select cache_key, value
+            from `{self.table_id}`
+            where kind = @kind and cache_key in unnest(@keys)
+            qualify row_number() over (partition by cache_key order by written_at desc) = 1
+                and expires_at > current_timestamp()
+        """
+        job_config = bigquery.QueryJobConfig(query_parameters=[
+            bigquery.ScalarQueryParameter("kind", "STRING", kind),
+            bigquery.ArrayQueryParameter("keys", "STRING", keys),
+        ])
+        rows = self.client.query(sql, job_config=job_config).result()
+        return {row["cache_key"]: row["value"] for row in rows}
+
+    def _write(self, kind, rows):
+        def ts(epoch):
+            return datetime.fromtimestamp(epoch, tz=timezone.utc).isoformat()
+
+        now = ts(time.time())
+        payload = [
+            {"kind": kind, "cache_key": key, "value": value, "expires_at": ts(expires_at), "written_at": now}
+            for key, value, expires_at in rows
+        ]
+        job_config = bigquery.LoadJobConfig(write_disposition=bigquery.WriteDisposition.WRITE_APPEND)
+        self.client.load_table_from_json(payload, self.table_id, job_config=job_config).result()
@@ -0,0 +1,90 @@
+import os
+import threading
+import uuid
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+DEFAULT_BUFFER_ROWS = 50000    # linhas mantidas em memória antes de gravar um row group
+
+## grava os dados extraídos em um arquivo Parquet local (/tmp), um row group por vez
+class ParquetSink:
+    """
+    Recebe DataFrames parciais (write) e os grava como row groups de um único arquivo Parquet,
+    mantendo em memória apenas o bloco corrente. O schema vem do primeiro bloco: colunas ausentes
+    nos blocos seguintes viram nulos e colunas novas (ex.: action_type que só aparece em páginas
+    posteriores) ampliam o schema, regravando o que já estava no arquivo (use allow-list de
+    action_types no modo streaming para evitar a regravação).
+    """
+
+    def __init__(self, path=None, buffer_rows=DEFAULT_BUFFER_ROWS, schema=None):
+        self.path = path or os.path.join("/tmp", f"meta_{uuid.uuid4().hex}.parquet")
+        self.buffer_rows = buffer_rows
+        self.rows = 0
+        # schema informado de antemão (ex.: união dos arquivos de um lote); None = primeiro bloco
+        self.schema = schema
+        self.writer = None
+        self._lock = threading.Lock()
+
+    def write(self, df):
+        # aceita DataFrame ou pyarrow.Table (ex.: row groups de outro Parquet)
+        if df is None or len(df) == 0:
+            return
+
+        with self._lock:
+            table = df if isinstance(df, pa.Table) else pa.Table.from_pandas(df, preserve_index=False)
+
+            if self.writer is None:
+                if self.schema is None:
+                    self.schema = self._fields(table.schema)
+                self.writer = pq.ParquetWriter(self.path, self.schema)
+
+            extra = [field for field in table.schema if field.name not in self.schema.names]
+            if extra:
+                self._widen(extra)
+
+            self.writer.write_table(self._align(table))
+            self.rows += table.num_rows
+
+    @staticmethod
+    def _fields(fields):
+        # colunas sem nenhum valor no bloco são tipadas como string
+        return pa.schema([
+            field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+            for field in fields
+        ]).remove_metadata()
+
+    def _widen(self, extra):
+        """Acrescenta colunas ao schema e regrava os row groups já gravados (um por vez) com nulos nelas."""
+        print(f"[parquet_sink] colunas novas {[field.name for field in extra]}: ampliando o schema e regravando {self.rows} linha(s)")
+        self.writer.close()
+        previous_path = f"{self.path}.old"
+        os.replace(self.path, previous_path)
+        try:
+            self.schema = pa.schema(list(self.schema) + list(self._fields(extra)))
+            self.writer = pq.ParquetWriter(self.path, self.schema)
+            previous = pq.ParquetFile(previous_path)
+            for i in range(previous.num_row_groups):
+                self.writer.write_table(self._align(previous.read_row_group(i)))
+        finally:
+            os.remove(previous_path)
+
+    def _align(self, table):
+        columns = []
+        for field in self.schema:
+            if field.name in table.column_names:
+                columns.append(table.column(field.name).cast(field.type))
+            else:
+                columns.append(pa.nulls(table.num_rows, type=field.type))
+        return pa.Table.from_arrays(columns, schema=self.schema)
+
+    def close(self):
+        with self._lock:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+        return self.rows
+
+    def remove(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
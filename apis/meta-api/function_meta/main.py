@@ -4,11 +4,25 @@ from pandas.io import gbq
 import os
 from datetime import datetime, timedelta
 from pytz import timezone
-from controller.MetaController import MetaController
+from controller.MetaController import MetaController, ASYNC_THRESHOLD_DAYS, POOL_SIZE, SHARD_WORKERS, build_session
+from controller.RateGovernor import RateGovernor
+from controller.ActionFlattener import first_action_value, flatten_action_columns
+from controller.ChangeDetector import PROBE_FIELDS, changed_days, contiguous_windows
 from database.BigQuery import BigQuery
+from database.BatchExport import BatchExport
+from database.ParquetSink import ParquetSink, DEFAULT_BUFFER_ROWS
+from database.CreativeCache import SqliteCreativeCache, BigQueryCreativeCache, DEFAULT_TTL, DEFAULT_NEGATIVE_TTL
 import logging as log
 from SecretManager import SecretManager
+from ClientRegistry import credential_key, registry
+from google.api_core.exceptions import Unauthorized
+from google.auth.exceptions import RefreshError
+from concurrent.futures import ThreadPoolExecutor
 
+DEFAULT_MAX_WORKERS = 4   # contas processadas em paralelo
+LOAD_MODES = ("delete_insert", "merge")
+CREATIVE_CACHE_BACKENDS = ("sqlite", "bigquery")
+CREATIVE_CACHE_TABLE = "meta_creative_cache"   # tabela do backend bigquery, no dataset do destino
 
 
 def get_parameter(json, parametro):
@@ -17,11 +31,240 @@ def get_parameter(json, parametro):
         raise Exception(f"O parâmetro {parametro} precisa ser preenchido.")
     return valor 
 
+def prepare_frame(df, run_config):
+    # colunas lista de {action_type, value}: legadas ficam com o 1º valor, as demais viram colunas largas
+    df = first_action_value(df)
+    return flatten_action_columns(df, action_types=run_config["action_types"])
+
+def get_bigquery(certificate_big_query, project_id):
+    """BigQuery autenticado, reaproveitado entre contas e execuções enquanto a instância estiver quente."""
+    def create():
+        bq = BigQuery(certificate_big_query, project_id)
+        bq.auth()
+        return bq
+
+    return registry.get("bigquery", credential_key(certificate_big_query, project_id), create)
+
+def get_creative_cache(request_json, certificate_big_query, project_id, destination_table):
+    """
+    Cache persistente da resolução de imagens (creative_cache: "sqlite" | "bigquery" | null),
+    mantido entre execuções enquanto a instância estiver quente. None desativa o cache.
+    """
+    backend = request_json.get("creative_cache")
+    if not backend:
+        return None
+    if backend not in CREATIVE_CACHE_BACKENDS:
+        raise Exception(f"creative_cache inválido: {backend}. Use um de {CREATIVE_CACHE_BACKENDS} ou null.")
+
+    ttl = int(request_json.get("creative_cache_ttl") or DEFAULT_TTL)
+    negative_ttl = min(ttl, DEFAULT_NEGATIVE_TTL)
+
+    if backend == "sqlite":
+        return registry.get("creative_cache", ("sqlite", ttl),
+                            lambda: SqliteCreativeCache(ttl=ttl, negative_ttl=negative_ttl))
+
+    dataset = destination_table.split(".")[0]
+    table_id = request_json.get("creative_cache_table") or f"{project_id}.{dataset}.{CREATIVE_CACHE_TABLE}"
+    bq = get_bigquery(certificate_big_query, project_id)
+    return registry.get("creative_cache", ("bigquery", table_id, ttl),
+                        lambda: BigQueryCreativeCache(bq.client, table_id, ttl=ttl, negative_ttl=negative_ttl))
+
+def read_certificate_path(config_file_path):
+    try:
+        with open(config_file_path, 'r') as f:
+            credentials = json.load(f)
+
+        return credentials.get('certificate_big_query')
+
+    except:
+        print(f"ERRO: Arquivo de configuração não encontrado em: {config_file_path}")
+        return None
+
+def load_window(account_id, meta_api, bq, start_date, end_date, run_config):
+    """Extrai a janela start_date..end_date da conta e a recarrega no destino (DELETE + load ou MERGE). Retorna as linhas."""
+    meta_api.start_date = start_date
+    meta_api.end_date = end_date
+
+    if run_config["batch"] is not None:
+        return stage_window(account_id, meta_api, run_config)
+
+    if run_config["streaming"]:
+        return load_window_streaming(account_id, meta_api, bq, start_date, end_date, run_config)
+
+    # Chama o método request_report com as datas e dataframe apropriados
+    df = meta_api.request_report('df')
+    df = prepare_frame(df, run_config)
+
+    # exporta os dados para o BigQuery
+    if run_config["load_mode"] == "merge":
+        return bq.merge(df, start_date, end_date, run_config["destination_table"], run_config["project_id"], account_id)
+
+    return bq.export(df, start_date, end_date, run_config["destination_table"], run_config["project_id"],
+                     run_config["if_exists"], account_id)
+
+def load_window_streaming(account_id, meta_api, bq, start_date, end_date, run_config):
+    """
+    Modo streaming: as páginas de insights são gravadas em blocos num Parquet em /tmp
+    e o arquivo é carregado direto no BigQuery; a memória não cresce com o tamanho da conta.
+    """
+    sink = ParquetSink(buffer_rows=run_config["streaming_buffer_rows"])
+    try:
+        rows = meta_api.request_report_to_parquet(sink, transform=lambda block: prepare_frame(block, run_config))
+        if run_config["load_mode"] == "merge":
+            if not rows:
+                bq.delete_window(start_date, end_date, run_config["destination_table"], run_config["project_id"], [account_id])
+                return 0
+            return bq.merge_parquet(sink.path, start_date, end_date, run_config["destination_table"],
+                                    run_config["project_id"], [account_id])
+
+        if not rows:
+            return 0
+
+        return bq.export_parquet(sink.path, start_date, end_date, run_config["destination_table"],
+                                 run_config["project_id"], run_config["if_exists"], account_id)
+    finally:
+        sink.remove()
+
+def stage_window(account_id, meta_api, run_config):
+    """
+    Modo batch: extrai a janela da conta para um Parquet próprio e o entrega ao lote da
+    execução; a carga no BigQuery é feita uma única vez, para todas as contas, no final.
+    """
+    sink = ParquetSink(buffer_rows=run_config["streaming_buffer_rows"])
+    try:
+        if run_config["streaming"]:
+            rows = meta_api.request_report_to_parquet(sink, transform=lambda block: prepare_frame(block, run_config))
+        else:
+            sink.write(prepare_frame(meta_api.request_report('df'), run_config))
+            rows = sink.close()
+    except Exception:
+        # conta com erro não entra no lote (nem no escopo do DELETE/MERGE)
+        sink.remove()
+        raise
+
+    run_config["batch"].add(account_id, sink)
+    return rows
+
+def changed_windows(account_id, meta_api, bq, run_config):
+    """
+    Detecção de mudanças: compara os totais diários da conta na Meta (spend, impressions,
+    clicks) com os já carregados no destino e retorna só as janelas contíguas com dias
+    divergentes, mais o dia de hoje (ainda em aberto). Sem campos comparáveis no
+    fields_list, a janela inteira é reprocessada.
+    """
+    start_date = run_config["start_date"]
+    end_date = run_config["end_date"]
+
+    fields = meta_api.probe_fields()
+    if not fields:
+        log.warning(f"Conta {account_id}: fields_list sem {PROBE_FIELDS}, reprocessando a janela inteira")
+        return [(start_date, end_date)]
+
+    source_totals = meta_api.request_daily_totals(fields)
+    destination_totals = bq.daily_totals(run_config["destination_table"], run_config["project_id"],
+                                         account_id, start_date, end_date, fields)
+
+    days = changed_days(source_totals, destination_totals, fields)
+    today = datetime.now().strftime("%Y-%m-%d")
+    if start_date <= today <= end_date:
+        days.append(today)
+
+    windows = contiguous_windows(days)
+    log.info(f"Conta {account_id}: {len(set(days))} dia(s) a reprocessar em {len(windows)} janela(s): {windows}")
+    return windows
+
+def process_account(account_id, run_config):
+    """
+    Extrai e carrega os dados de uma única conta.
+    run_config traz os parâmetros comuns da execução (token, datas, destino, opções).
+    Nunca propaga exceções: o erro é devolvido no resultado para não abortar as demais contas.
+    """
+    start_date = run_config["start_date"]
+    end_date = run_config["end_date"]
+    project_id = run_config["project_id"]
+
+    try:
+        # Cria uma instância de MetaController
+        meta_api = MetaController(run_config["access_token"], run_config["app_id"], run_config["app_key_secret"],
+                                  account_id, run_config["fields_list"], start_date, end_date,
+                                  **run_config["controller_options"])
+
+        # Autentica a instância
+        meta_api.auth()
+            
+        #classe responsável pela comunicação com BigQuery (autenticada uma vez por instância)
+        # no modo batch a conta só é extraída para o lote; quem fala com o BigQuery é o BatchExport
+        bq = None if run_config["batch"] is not None else get_bigquery(run_config["certificate_big_query"], project_id)
+
+        windows = [(start_date, end_date)]
+        if run_config["change_detection"]:
+            windows = changed_windows(account_id, meta_api, bq, run_config)
+            if not windows:
+                return {
+                    "account_id": account_id,
+                    "status": "Ok",
+                    "message": "No changes detected",
+                    "lines": 0
+                }
+
+        #A conta ´pode não ter dados para o periodo
+        rstLinesLoading = 0
+        for window_start, window_end in windows:
+            rstLinesLoading += load_window(account_id, meta_api, bq, window_start, window_end, run_config)
+
+        if run_config["batch"] is not None:
+            # ainda não carregado: load_batch define o status final depois da carga do lote
+            return {
+                "account_id": account_id,
+                "status": "Staged",
+                "message": "Staged for batch load",
+                "lines": rstLinesLoading
+            }
+
+        return {
+            "account_id": account_id,
+            "status": "Ok",
+            "message": "Data Loaded" if rstLinesLoading else "No data to load into bigquery",
+            "lines": rstLinesLoading
+        }
+
+    except Exception as e:
+        log.error(f"Erro ao processar a conta {account_id}: {e}")
+        if isinstance(e, (RefreshError, Unauthorized)):
+            # credencial do BigQuery inválida: recria o cliente na próxima execução
+            registry.invalidate("bigquery", credential_key(run_config["certificate_big_query"], project_id))
+        return {
+            "account_id": account_id,
+            "status": "Error",
+            "message": str(e),
+            "lines": 0
+        }
+
+def load_batch(batch, results):
+    """
+    Carga única do lote. As contas extraídas ("Staged") passam a Ok se a carga der certo
+    ou ficam todas com erro se falhar.
+    """
+    staged = [result for result in results if result["status"] == "Staged"]
+    try:
+        batch.load()
+    except Exception as e:
+        log.error(f"Erro na carga do lote: {e}")
+        for result in staged:
+            result.update({"status": "Error", "message": f"Batch load failed: {e}", "lines": 0})
+        return
+
+    for result in staged:
+        result.update({
+            "status": "Ok",
+            "message": "Data Loaded" if result["lines"] else "No data to load into bigquery",
+        })
+
 def main(request):
     
     log.info("Iniciando execução Meta")
     
-    secret_manager = SecretManager()
+    secret_manager = registry.get("secret_manager", "default", SecretManager)
 
     secret_id = "{INSIRA O NOME DO SECRET}"
     project_id = "76816773014" # PROJECT_ID DO PROJETO CADMETRICS-PRD
@@ -39,21 +282,12 @@ def main(request):
     app_key_secret = secret["app_secret"]
   
     request_json = request.get_json()
-   
-    rst = None
 
     base_dir = os.path.dirname(os.path.abspath(__file__))
     config_file_path = os.path.join(base_dir, 'config', 'credentials.json')
 
-    try:
-        with open(config_file_path, 'r') as f:
-            credentials = json.load(f)
-
-        certificate_big_query = credentials.get('certificate_big_query')
-
-    except:
-        print(f"ERRO: Arquivo de configuração não encontrado em: {config_file_path}")
-        certificate_big_query = None
+    # o arquivo é lido uma vez por instância
+    certificate_big_query = registry.get("config", config_file_path, lambda: read_certificate_path(config_file_path))
    
     days_reprocess = 7
    
@@ -82,56 +316,92 @@ def main(request):
     log.info(f"All JSON: {request_json}")
     
     
-    for account_id in account_list:
-    
-        
-        # Cria uma instância de MetaController
-        meta_api = MetaController(access_token, app_id, app_key_secret, account_id, fields_list, start_date, end_date)
+    load_mode = request_json.get("load_mode") or "delete_insert"
+    if load_mode not in LOAD_MODES:
+        raise Exception(f"load_mode inválido: {load_mode}. Use um de {LOAD_MODES}.")
 
-        # Autentica a instância
-        meta_api.auth()
-            
-        # Chama o método request_report com as datas e dataframe apropriados
-        df = meta_api.request_report('df')
+    # batch_load: todas as contas numa única carga (número constante de jobs no BigQuery)
+    batch_load = bool(request_json.get("batch_load", False))
+    change_detection = bool(request_json.get("change_detection", False))
+    if batch_load and change_detection:
+        raise Exception("batch_load e change_detection não podem ser usados juntos (janelas diferentes por conta).")
 
-        # Function to extract the 'value' from each dictionary
-        def extract_value(dictionary_list):
-            if isinstance(dictionary_list, list) and len(dictionary_list) > 0:
-                dictionary = dictionary_list[0]
-                return dictionary.get('value', None)
-            else:
-                return None
+    max_workers = int(request_json.get("max_workers") or DEFAULT_MAX_WORKERS)
+    shard_workers = int(request_json.get("shard_workers") or SHARD_WORKERS)
+    pool_size = max(POOL_SIZE, max_workers * shard_workers)
 
-        for col in ['video_play_actions', 'video_thruplay_watched_actions', 'video_p100_watched_actions', 'video_p25_watched_actions']:
-            if col in df.columns:
-                df[col] = df[col].apply(lambda x: extract_value(x))
-            else:
-                log.warning(f"Coluna {col} não encontrada no DataFrame. Pulando.")
+    run_config = {
+        "access_token": access_token,
+        "app_id": app_id,
+        "app_key_secret": app_key_secret,
+        "fields_list": fields_list,
+        "start_date": start_date,
+        "end_date": end_date,
+        "certificate_big_query": certificate_big_query,
+        "project_id": project_id,
+        "destination_table": destination_table,
+        "if_exists": if_exists,
+        # "delete_insert" (DELETE da janela + carga) ou "merge" (staging em Parquet + MERGE atômico)
+        "load_mode": load_mode,
+        # sonda os totais diários da conta e recarrega só os dias alterados (+ hoje)
+        "change_detection": change_detection,
+        # modo streaming: grava em Parquet (/tmp) em blocos de streaming_buffer_rows linhas
+        "streaming": bool(request_json.get("streaming", False)),
+        "streaming_buffer_rows": int(request_json.get("streaming_buffer_rows") or DEFAULT_BUFFER_ROWS),
+        # allow-list de action_type para as colunas actions/action_values/...; null = todos
+        "action_types": request_json.get("action_types"),
+        # opções repassadas ao MetaController de cada conta
+        "controller_options": {
+            # janelas maiores que isso (em dias) usam report run assíncrono; null desativa
+            "async_threshold_days": request_json.get("async_threshold_days", ASYNC_THRESHOLD_DAYS),
+            # divide a janela em sub-janelas de shard_days dias buscadas em paralelo; null = janela inteira
+            "shard_days": request_json.get("shard_days"),
+            "shard_workers": shard_workers,
+            # uma única sessão HTTP (pool keep-alive) para todas as contas, mantida entre execuções
+            "session": registry.get("meta_session", pool_size, lambda: build_session(pool_size=pool_size)),
+            # cache persistente de ad -> creative -> imagem (sqlite local ou tabela BigQuery); null desativa
+            "creative_cache": get_creative_cache(request_json, certificate_big_query, project_id, destination_table),
+            # uso por app/conta (headers de throttling) compartilhado entre os workers da execução;
+            # novo a cada execução para não herdar leituras/bloqueios antigos da instância quente
+            "rate_governor": RateGovernor(),
+        },
+    }
 
+    run_config["batch"] = None
+    if batch_load:
+        bq = get_bigquery(certificate_big_query, project_id)
+        run_config["batch"] = BatchExport(bq, start_date, end_date, destination_table, project_id, if_exists,
+                                          load_mode=load_mode, buffer_rows=run_config["streaming_buffer_rows"])
 
-        #instancia classe responsável pela comunicação com BigQuery
-        bq = BigQuery(certificate_big_query, project_id)
+    log.info(f"Processando {len(account_list)} contas com {max_workers} workers")
 
-        # ## efetua autenticação com BigQuery
-        bq.auth()
+    try:
+        # uma conta por worker; executor.map preserva a ordem do account_list na resposta
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(lambda account_id: process_account(account_id, run_config), account_list))
 
-       # exporta os dados para o BigQuery
-       #A conta ´pode não ter dados para o periodo, retornando um df vazio
-        if df is not None: 
-            rstLinesLoading = bq.export(df, start_date, end_date, destination_table, project_id, if_exists, account_id)
+        if run_config["batch"] is not None:
+            load_batch(run_config["batch"], results)
+    finally:
+        if run_config["batch"] is not None:
+            run_config["batch"].remove()
 
-            rst = {
-                "status": "Ok",
-                "message": "Data Loaded",
-                "lines": rstLinesLoading
-            }
-        else:
-            rst = {
-                "status": "Ok",
-                "message": "No data to load into bigquery",
-                "lines": 0
-            }
+    errors = [r for r in results if r["status"] == "Error"]
+    all_failed = bool(results) and len(errors) == len(results)
 
+    if not errors:
+        status, message = "Ok", "Data Loaded"
+    elif all_failed:
+        status, message = "Error", f"Todas as {len(errors)} conta(s) com erro"
+    else:
+        status, message = "Partial", f"{len(errors)} conta(s) com erro"
 
-    return json.dumps(rst), 200, {'Content-Type': 'application/json'}
+    rst = {
+        "status": status,
+        "message": message,
+        "lines": sum(r["lines"] for r in results),
+        "results": results
+    }
 
+    # nenhuma conta carregada: a execução falhou (o orquestrador pode tentar de novo)
+    return json.dumps(rst), 500 if all_failed else 200, {'Content-Type': 'application/json'}
@@ -0,0 +1 @@
+"""Módulos compartilhados pelas APIs (google-ads, bing-ads, dv360)."""
@@ -0,0 +1,93 @@
+"""
+Registro de clientes por instância (Cloud Run)
+
+Mantém clientes pesados (BigQuery, Google Ads, autenticação Bing, serviço DV360,
+sessão HTTP da TikTok) vivos entre requisições de uma mesma instância quente, evitando reconstrução e
+refresh de OAuth a cada chamada.
+"""
+
+import hashlib
+import threading
+import time
+from typing import Any, Callable, Hashable, Optional
+
+from loguru import logger
+
+
+def credential_key(*parts: Any) -> str:
+    """Chave estável para um conjunto de credenciais (hash; o segredo não fica em memória como chave)."""
+    raw = "\x1f".join("" if part is None else str(part) for part in parts)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ClientRegistry:
+    """
+    Registro thread-safe de objetos criados sob demanda, por (tipo, chave).
+
+    Cada objeto é criado uma única vez (mesmo com threads concorrentes pedindo a
+    mesma chave) e reaproveitado até expirar (ttl) ou ser invalidado.
+    """
+
+    def __init__(self):
+        self._entries: dict = {}  # (kind, key) -> (objeto, expira_em ou None)
+        self._create_locks: dict = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        kind: str,
+        key: Hashable,
+        factory: Callable[[], Any],
+        ttl: Optional[float] = None,
+    ) -> Any:
+        """
+        Retorna o objeto registrado ou o cria com factory.
+
+        Args:
+            kind: Tipo do objeto (ex.: "bigquery")
+            key: Chave do objeto dentro do tipo (ex.: credential_key(...))
+            factory: Função sem argumentos que cria o objeto
+            ttl: Segundos de validade (None = vida da instância)
+
+        Returns:
+            Objeto registrado
+        """
+        entry_key = (kind, key)
+        entry = self._entries.get(entry_key)
+        if self._valid(entry):
+            return entry[0]
+
+        with self._lock:
+            create_lock = self._create_locks.setdefault(entry_key, threading.Lock())
+
+        with create_lock:
+            entry = self._entries.get(entry_key)
+            if self._valid(entry):
+                return entry[0]
+
+            logger.info(f"Criando cliente '{kind}' (instância fria ou expirado)")
+            obj = factory()
+            self._entries[entry_key] = (obj, time.time() + ttl if ttl else None)
+            return obj
+
+    def invalidate(self, kind: Optional[str] = None, key: Optional[Hashable] = None) -> None:
+        """
+        Remove objetos do registro (ex.: após erro de autenticação).
+
+        Args:
+            kind: Tipo a invalidar (None = todos)
+            key: Chave a invalidar dentro do tipo (None = todas)
+        """
+        with self._lock:
+            for entry_key in list(self._entries):
+                if (kind is None or entry_key[0] == kind) and (key is None or entry_key[1] == key):
+                    del self._entries[entry_key]
+                    logger.info(f"Cliente '{entry_key[0]}' invalidado")
+
+    @staticmethod
+    def _valid(entry) -> bool:
+        return entry is not None and (entry[1] is None or entry[1] > time.time())
+
+
+# registro único do processo
+registry = ClientRegistry()
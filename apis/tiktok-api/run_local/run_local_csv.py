@@ -25,8 +25,9 @@ REPORT_TYPES = os.getenv("REPORT_TYPES")
 if sys.platform == "win32":
     os.system("chcp 65001 > nul")
 
-# Adiciona o diretório src ao path para importar os módulos
+# Adiciona o diretório src (e apis/, para o pacote shared) ao path para importar os módulos
 src_path = Path(__file__).parent.parent / "src"
+sys.path.insert(0, str(src_path.parent.parent))
 sys.path.insert(0, str(src_path))
 from loguru import logger
 from config.settings import TABLES, DIMENSIONS, DATA_LEVELS
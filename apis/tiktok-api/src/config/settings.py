@@ -18,6 +18,24 @@ TABLES = {
 # TikTok API Settings
 TIKTOK_API_BASE_URL = "https://business-api.tiktok.com/open_api/v1.3"
 TIKTOK_REPORT_ENDPOINT = "/report/integrated/get/"
+TIKTOK_REPORT_TASK_CREATE_ENDPOINT = "/report/task/create/"
+TIKTOK_REPORT_TASK_CHECK_ENDPOINT = "/report/task/check/"
+TIKTOK_REPORT_TASK_DOWNLOAD_ENDPOINT = "/report/task/download/"
+TIKTOK_AD_GET_ENDPOINT = "/ad/get/"
+
+# Paginação do relatório síncrono: após a página 1 (que informa total_page),
+# as páginas 2..N são buscadas em paralelo
+PAGE_SIZE = 1000
+PAGE_WORKERS = 4  # páginas simultâneas por relatório
+
+# Modo de extração: "sync" (paginação) ou "async" (report task, indicado para
+# AUCTION_AD em janelas longas)
+REPORT_MODES = ("sync", "async")
+DEFAULT_REPORT_MODE = "sync"
+REPORT_TASK_POLL_INTERVAL = 10  # segundos entre consultas de status (inicial)
+REPORT_TASK_POLL_MAX_INTERVAL = 60  # teto do backoff entre consultas
+REPORT_TASK_TIMEOUT = 1800  # tempo máximo aguardando um report task
+REPORT_TASK_CSV_CHUNK_ROWS = 50000  # linhas do CSV convertidas por bloco
 
 # Dimensões por nível de relatório
 DIMENSIONS = {
@@ -35,9 +53,135 @@ DATA_LEVELS = {
     "ad": "AUCTION_AD",
 }
 
-# Métricas disponíveis (todas)
-METRICS = [
+# Métricas disponíveis (todas) e o tipo de cada uma: "int" (contagens, Int64 com nulos)
+# ou "float" (valores monetários, taxas e médias). _parse_response converte cada coluna
+# uma única vez para o tipo declarado.
+METRIC_DTYPES = {
     # Basic / Core
+    "spend": "float",
+    "impressions": "int",
+    "clicks": "int",
+    "ctr": "float",
+    "cpc": "float",
+    "cpm": "float",
+    "reach": "int",
+    "frequency": "float",
+    
+    # Engagement / Social
+    "profile_visits": "int",
+    "likes": "int",
+    "comments": "int",
+    "shares": "int",
+    "follows": "int",
+    "engagements": "int",
+    "clicks_on_music_disc": "int",
+    
+    # Video
+    "video_play_actions": "int",
+    "video_watched_2s": "int",
+    "video_watched_6s": "int",
+    "average_video_play": "float",
+    "average_video_play_per_user": "float",
+    "video_views_p25": "int",
+    "video_views_p50": "int",
+    "video_views_p75": "int",
+    "video_views_p100": "int",
+    
+    # Conversion
+    "conversions": "int",
+    "conversion_rate": "float",
+    "cost_per_conversion": "float",
+    "real_time_conversions": "int",
+    "real_time_conversion_rate": "float",
+    "cost_per_real_time_conversion": "float",
+    "results": "int",
+    "result_rate": "float",
+    "cost_per_result": "float",
+    "real_time_result": "int",
+    "real_time_result_rate": "float",
+    "real_time_cost_per_result": "float",
+    
+    # In-App Events
+    "app_install": "int",
+    "real_time_app_install": "int",
+    "registration": "int",
+    "total_registration": "int",
+    "purchase": "int",
+    "total_purchase": "int",
+    "total_purchase_value": "float",
+    "app_event_add_to_cart": "int",
+    "total_app_event_add_to_cart": "int",
+    "total_app_event_add_to_cart_value": "float",
+    "checkout": "int",
+    "total_checkout": "int",
+    "total_checkout_value": "float",
+    "view_content": "int",
+    "total_view_content": "int",
+    "total_view_content_value": "float",
+    "add_payment_info": "int",
+    "total_add_payment_info": "int",
+    "add_to_wishlist": "int",
+    "total_add_to_wishlist": "int",
+    "total_add_to_wishlist_value": "float",
+    "complete_tutorial": "int",
+    "total_complete_tutorial": "int",
+    "login": "int",
+    "total_login": "int",
+    "search": "int",
+    "total_search": "int",
+    "subscribe": "int",
+    "total_subscribe": "int",
+    "total_subscribe_value": "float",
+    
+    # Attribution
+    "vta_conversion": "int",
+    "vta_purchase": "int",
+    "cta_conversion": "int",
+    "cta_purchase": "int",
+    
+    # Cost metrics
+    "cost_per_1000_reached": "float",
+    "cost_per_app_install": "float",
+    "cost_per_registration": "float",
+    "cost_per_purchase": "float",
+}
+
+METRICS = list(METRIC_DTYPES)
+
+# Métricas que não podem ser somadas do ad-level (alcance único, taxas, médias e custos
+# unitários). No modo rollup, só elas são extraídas nos níveis advertiser/campaign/adgroup;
+# as demais (ADDITIVE_METRICS) são somadas localmente a partir do relatório ad-level.
+NON_ADDITIVE_METRICS = [
+    "reach",
+    "frequency",
+    "ctr",
+    "cpc",
+    "cpm",
+    "average_video_play",
+    "average_video_play_per_user",
+    "conversion_rate",
+    "cost_per_conversion",
+    "real_time_conversion_rate",
+    "cost_per_real_time_conversion",
+    "result_rate",
+    "cost_per_result",
+    "real_time_result_rate",
+    "real_time_cost_per_result",
+    "cost_per_1000_reached",
+    "cost_per_app_install",
+    "cost_per_registration",
+    "cost_per_purchase",
+]
+
+ADDITIVE_METRICS = [metric for metric in METRICS if metric not in NON_ADDITIVE_METRICS]
+
+# Modo rollup desligado por padrão (ativado por requisição com "rollup": true)
+DEFAULT_ROLLUP = False
+
+# Perfis de métricas: nome -> métricas extraídas. Um perfil pode ser escolhido por
+# report_type e por advertiser (este tem precedência); o payload de /run pode sobrepor
+# ambos em "metric_profiles" (nome de perfil ou lista explícita de métricas).
+CORE_METRICS = [
     "spend",
     "impressions",
     "clicks",
@@ -46,17 +190,12 @@ METRICS = [
     "cpm",
     "reach",
     "frequency",
-    
-    # Engagement / Social
     "profile_visits",
     "likes",
     "comments",
     "shares",
     "follows",
     "engagements",
-    "clicks_on_music_disc",
-    
-    # Video
     "video_play_actions",
     "video_watched_2s",
     "video_watched_6s",
@@ -66,8 +205,10 @@ METRICS = [
     "video_views_p50",
     "video_views_p75",
     "video_views_p100",
-    
-    # Conversion
+    "cost_per_1000_reached",
+]
+
+CONVERSION_METRICS = [
     "conversions",
     "conversion_rate",
     "cost_per_conversion",
@@ -80,51 +221,102 @@ METRICS = [
     "real_time_result",
     "real_time_result_rate",
     "real_time_cost_per_result",
-    
-    # In-App Events
-    "app_install",
-    "real_time_app_install",
-    "registration",
-    "total_registration",
-    "purchase",
-    "total_purchase",
-    "total_purchase_value",
-    "app_event_add_to_cart",
-    "total_app_event_add_to_cart",
-    "total_app_event_add_to_cart_value",
-    "checkout",
-    "total_checkout",
-    "total_checkout_value",
-    "view_content",
-    "total_view_content",
-    "total_view_content_value",
-    "add_payment_info",
-    "total_add_payment_info",
-    "add_to_wishlist",
-    "total_add_to_wishlist",
-    "total_add_to_wishlist_value",
-    "complete_tutorial",
-    "total_complete_tutorial",
-    "login",
-    "total_login",
-    "search",
-    "total_search",
-    "subscribe",
-    "total_subscribe",
-    "total_subscribe_value",
-    
-    # Attribution
     "vta_conversion",
-    "vta_purchase",
     "cta_conversion",
-    "cta_purchase",
-    
-    # Cost metrics
-    "cost_per_1000_reached",
-    "cost_per_app_install",
-    "cost_per_registration",
-    "cost_per_purchase",
 ]
 
+METRIC_PROFILES = {
+    "full": METRICS,
+    "core": CORE_METRICS,
+    "lead_gen": CORE_METRICS + CONVERSION_METRICS + [
+        "registration",
+        "total_registration",
+        "cost_per_registration",
+        "complete_tutorial",
+        "total_complete_tutorial",
+        "subscribe",
+        "total_subscribe",
+        "total_subscribe_value",
+    ],
+    "ecommerce": CORE_METRICS + CONVERSION_METRICS + [
+        "purchase",
+        "total_purchase",
+        "total_purchase_value",
+        "cost_per_purchase",
+        "app_event_add_to_cart",
+        "total_app_event_add_to_cart",
+        "total_app_event_add_to_cart_value",
+        "checkout",
+        "total_checkout",
+        "total_checkout_value",
+        "view_content",
+        "total_view_content",
+        "total_view_content_value",
+        "add_payment_info",
+        "total_add_payment_info",
+        "add_to_wishlist",
+        "total_add_to_wishlist",
+        "total_add_to_wishlist_value",
+        "vta_purchase",
+        "cta_purchase",
+    ],
+    "app": CORE_METRICS + CONVERSION_METRICS + [
+        "app_install",
+        "real_time_app_install",
+        "cost_per_app_install",
+        "registration",
+        "total_registration",
+        "cost_per_registration",
+        "purchase",
+        "total_purchase",
+        "total_purchase_value",
+        "cost_per_purchase",
+        "app_event_add_to_cart",
+        "total_app_event_add_to_cart",
+        "total_app_event_add_to_cart_value",
+        "checkout",
+        "total_checkout",
+        "total_checkout_value",
+        "complete_tutorial",
+        "total_complete_tutorial",
+        "login",
+        "total_login",
+        "search",
+        "total_search",
+    ],
+}
+
+DEFAULT_METRIC_PROFILE = "full"
+REPORT_TYPE_METRIC_PROFILES: dict = {}  # ex.: {"advertiser": "core"}
+ADVERTISER_METRIC_PROFILES: dict = {}  # ex.: {"7012345678901234567": "lead_gen"}
+
+# Poda automática de métricas ("prune_metrics": true): uma métrica deixa de ser pedida
+# quando veio zerada/nula nas últimas PRUNE_ZERO_RUNS execuções em que foi pedida
+# (por advertiser e report_type). O histórico considerado é de PRUNE_RECHECK_DAYS dias:
+# quando as execuções que justificaram a poda saem da janela, a métrica volta a ser pedida.
+DEFAULT_PRUNE_METRICS = False
+PRUNE_ZERO_RUNS = 5
+PRUNE_RECHECK_DAYS = 14
+PRUNE_KEEP_METRICS = ["spend", "impressions", "clicks"]  # nunca podadas
+METRIC_USAGE_TABLE = "TKT000_TIKTOK_METRIC_USAGE"  # histórico de métricas por execução
+
 # Dias de reprocessamento padrão
 DEFAULT_DAYS_REPROCESS = 3
+
+# Concorrência da matriz advertiser x report_type
+DEFAULT_MAX_WORKERS = 4  # extrações simultâneas no total
+DEFAULT_MAX_WORKERS_PER_ADVERTISER = 2  # extrações simultâneas por advertiser
+
+# Rate limit da TikTok API (token bucket compartilhado pelos workers do processo)
+TIKTOK_APP_QPS = 10  # chamadas/s do app inteiro
+TIKTOK_ADVERTISER_QPS = 5  # chamadas/s por advertiser
+RATE_LIMIT_MIN_QPS = 0.5  # piso da taxa após reduções por 40100
+RATE_LIMIT_RECOVERY_SUCCESSES = 20  # sucessos seguidos para recuperar 10% da taxa
+RATE_LIMIT_BACKOFF_BASE = 2  # bloqueio (s) no primeiro 40100, dobra a cada 40100 seguido
+RATE_LIMIT_BACKOFF_MAX = 60  # bloqueio máximo (s)
+RATE_LIMIT_MAX_RETRIES = 8  # tentativas de uma chamada que só recebe 40100
+
+# Jobs assíncronos de /run (?async=true)
+JOBS_TABLE = f"{DATASET_ID}.TKT000_TIKTOK_JOBS"  # snapshots de estado (em PROJECT_ID)
+JOB_WORKERS = 2  # jobs executados ao mesmo tempo por instância
+JOB_STALE_AFTER = 3600  # s sem atualização para um job de outra instância ser dado como interrompido
@@ -3,21 +3,86 @@ TikTok Ads API Controller
 Responsável por autenticação e extração de relatórios da API TikTok Business
 """
 
+import io
+import json
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Optional
+from typing import Iterator, List, Optional
 
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
 from loguru import logger
 
 from config.settings import (
     TIKTOK_API_BASE_URL,
     TIKTOK_REPORT_ENDPOINT,
+    TIKTOK_REPORT_TASK_CREATE_ENDPOINT,
+    TIKTOK_REPORT_TASK_CHECK_ENDPOINT,
+    TIKTOK_REPORT_TASK_DOWNLOAD_ENDPOINT,
+    TIKTOK_AD_GET_ENDPOINT,
+    REPORT_MODES,
+    REPORT_TASK_POLL_INTERVAL,
+    REPORT_TASK_POLL_MAX_INTERVAL,
+    REPORT_TASK_TIMEOUT,
+    REPORT_TASK_CSV_CHUNK_ROWS,
+    PAGE_SIZE,
+    PAGE_WORKERS,
+    TIKTOK_APP_QPS,
+    TIKTOK_ADVERTISER_QPS,
+    RATE_LIMIT_MIN_QPS,
+    RATE_LIMIT_RECOVERY_SUCCESSES,
+    RATE_LIMIT_BACKOFF_BASE,
+    RATE_LIMIT_BACKOFF_MAX,
+    RATE_LIMIT_MAX_RETRIES,
     DIMENSIONS,
     DATA_LEVELS,
     METRICS,
+    METRIC_DTYPES,
 )
+from core.RateLimiter import AdaptiveRateLimiter
+from shared.registry import registry
+
+POOL_SIZE = 16  # conexões keep-alive mantidas por host
+
+
+def build_session(pool_size: int = POOL_SIZE) -> requests.Session:
+    """
+    Cria a sessão HTTP usada nas chamadas à TikTok (conexões keep-alive reaproveitadas).
+    Pode ser compartilhada entre controllers e requisições da mesma instância.
+    """
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    return session
+
+
+def build_rate_limiter(
+    app_qps: float = TIKTOK_APP_QPS,
+    advertiser_qps: float = TIKTOK_ADVERTISER_QPS,
+) -> AdaptiveRateLimiter:
+    """Cria o limitador de chamadas à TikTok com os parâmetros de config/settings.py."""
+    return AdaptiveRateLimiter(
+        app_qps=app_qps,
+        advertiser_qps=advertiser_qps,
+        min_qps=RATE_LIMIT_MIN_QPS,
+        recovery_successes=RATE_LIMIT_RECOVERY_SUCCESSES,
+        backoff_base=RATE_LIMIT_BACKOFF_BASE,
+        backoff_max=RATE_LIMIT_BACKOFF_MAX,
+    )
+
+
+def shared_rate_limiter(
+    app_qps: float = TIKTOK_APP_QPS,
+    advertiser_qps: float = TIKTOK_ADVERTISER_QPS,
+) -> AdaptiveRateLimiter:
+    """Limitador único do processo para a combinação de QPS (compartilhado por todos os workers)."""
+    return registry.get(
+        "tiktok_rate_limiter",
+        (app_qps, advertiser_qps),
+        lambda: build_rate_limiter(app_qps, advertiser_qps),
+    )
 
 
 class TikTokAdsController:
@@ -30,6 +95,10 @@ class TikTokAdsController:
         start_date: str,
         end_date: str,
         report_type: str = "campaign",
+        session: Optional[requests.Session] = None,
+        report_mode: str = "sync",
+        rate_limiter: Optional[AdaptiveRateLimiter] = None,
+        metrics: Optional[List[str]] = None,
     ):
         """
         Inicializa o controller.
@@ -40,13 +109,27 @@ class TikTokAdsController:
             start_date: Data inicial (YYYY-MM-DD)
             end_date: Data final (YYYY-MM-DD)
             report_type: Tipo de relatório (advertiser, campaign, adgroup, ad)
+            session: Sessão HTTP compartilhada (opcional; cria uma própria se omitida)
+            report_mode: "sync" (paginação em /report/integrated/get/) ou
+                "async" (report task: cria, acompanha e baixa o arquivo)
+            rate_limiter: Limitador de chamadas (opcional; usa o compartilhado do processo)
+            metrics: Métricas a extrair (default: METRICS)
         """
+        if report_mode not in REPORT_MODES:
+            raise ValueError(f"report_mode inválido: {report_mode}. Use um de {REPORT_MODES}.")
+
         self.access_token = access_token
         self.advertiser_id = str(advertiser_id).replace("-", "").strip()
         self.start_date = start_date
         self.end_date = end_date
         self.report_type = report_type
         self.base_url = TIKTOK_API_BASE_URL
+        self.session = session or build_session()
+        self.report_mode = report_mode
+        self.rate_limiter = rate_limiter or shared_rate_limiter()
+        if metrics is not None and not metrics:
+            raise ValueError("Lista de métricas vazia (use None para todas as métricas).")
+        self.metrics = metrics
         self.headers = {
             "Access-Token": self.access_token,
             "Content-Type": "application/json",
@@ -60,9 +143,14 @@ class TikTokAdsController:
         """Retorna o data_level para o tipo de relatório."""
         return DATA_LEVELS.get(self.report_type, DATA_LEVELS["campaign"])
 
+    @property
+    def requested_metrics(self) -> List[str]:
+        """Métricas pedidas à API (metrics informado ou, se None, METRICS)."""
+        return METRICS if self.metrics is None else self.metrics
+
     def _get_metrics(self) -> list:
         """Retorna lista de métricas a serem extraídas."""
-        return METRICS
+        return self.requested_metrics
 
     def _build_report_payload(self, page: int = 1, page_size: int = 1000) -> dict:
         """
@@ -99,125 +187,324 @@ class TikTokAdsController:
         """
         Realiza requisição à API com retry.
 
+        Cada chamada passa pelo rate limiter compartilhado. Rate limit (código 40100 ou
+        HTTP 429) reduz a taxa do processo e espera o backoff do limitador, com orçamento
+        próprio de RATE_LIMIT_MAX_RETRIES tentativas; demais erros usam backoff
+        exponencial com jitter.
+
         Args:
             endpoint: Endpoint da API
             method: Método HTTP
             params: Query parameters
             json_data: Body JSON
-            max_retries: Número máximo de tentativas
+            max_retries: Número máximo de tentativas (erros que não são rate limit)
 
         Returns:
             Resposta da API em JSON
         """
         url = f"{self.base_url}{endpoint}"
+        failures = 0
+        rate_limited = 0
 
-        for attempt in range(max_retries):
+        while True:
+            self.rate_limiter.acquire(self.advertiser_id)
             try:
                 if method.upper() == "GET":
-                    response = requests.get(
+                    response = self.session.get(
                         url,
                         headers=self.headers,
                         params=params,
                         timeout=120,
                     )
                 else:
-                    response = requests.post(
+                    response = self.session.post(
                         url,
                         headers=self.headers,
                         json=json_data,
                         timeout=120,
                     )
 
-                response.raise_for_status()
-                data = response.json()
+                if response.status_code == 429:
+                    data = {"code": 40100, "message": "HTTP 429 Too Many Requests"}
+                else:
+                    response.raise_for_status()
+                    data = response.json()
+
+                # Rate limit - o limitador reduz a taxa e bloqueia as próximas chamadas
+                if data.get("code") == 40100:
+                    rate_limited += 1
+                    if rate_limited >= RATE_LIMIT_MAX_RETRIES:
+                        raise Exception(
+                            f"TikTok API rate limit: {data.get('message')} "
+                            f"({rate_limited} tentativas)"
+                        )
+                    self.rate_limiter.on_rate_limited(self.advertiser_id)
+                    continue
 
                 # Verifica código de erro da API TikTok
                 if data.get("code") != 0:
                     error_msg = data.get("message", "Unknown error")
+                    failures += 1
                     logger.warning(
-                        f"TikTok API error (attempt {attempt + 1}): {error_msg}"
+                        f"TikTok API error (attempt {failures}): {error_msg}"
                     )
-
-                    # Rate limit - aguarda e tenta novamente
-                    if data.get("code") == 40100:
-                        wait_time = 60 * (attempt + 1)
-                        logger.info(f"Rate limit hit. Waiting {wait_time}s...")
-                        time.sleep(wait_time)
-                        continue
-
-                    if attempt < max_retries - 1:
-                        time.sleep(5 * (attempt + 1))
+                    if failures < max_retries:
+                        time.sleep(AdaptiveRateLimiter.backoff(failures, base=2.5))
                         continue
                     raise Exception(f"TikTok API error: {error_msg}")
 
+                self.rate_limiter.on_success(self.advertiser_id)
                 return data
 
             except requests.exceptions.RequestException as e:
-                logger.warning(f"Request error (attempt {attempt + 1}): {e}")
-                if attempt < max_retries - 1:
-                    time.sleep(5 * (attempt + 1))
+                failures += 1
+                logger.warning(f"Request error (attempt {failures}): {e}")
+                if failures < max_retries:
+                    time.sleep(AdaptiveRateLimiter.backoff(failures, base=2.5))
                     continue
                 raise
 
-        raise Exception(f"Max retries ({max_retries}) exceeded")
-
     def fetch_report(self) -> pd.DataFrame:
         """
-        Extrai relatório completo com paginação.
+        Extrai relatório completo com paginação (ou via report task no modo async).
 
         Returns:
             DataFrame com todos os dados do relatório
         """
+        if self.report_mode == "async":
+            return self.fetch_report_async()
+
         logger.info(
             f"Fetching {self.report_type} report for advertiser {self.advertiser_id}"
         )
         logger.info(f"Period: {self.start_date} to {self.end_date}")
 
-        all_data = []
+        # página 1 informa o total; as demais são buscadas em paralelo
+        first = self._fetch_page(1)
+        all_data = list(first.get("list") or [])
+        total_pages = int(first.get("page_info", {}).get("total_page") or 1)
+
+        if total_pages > 1:
+            logger.info(
+                f"Fetching pages 2..{total_pages} with up to {PAGE_WORKERS} workers"
+            )
+            with ThreadPoolExecutor(
+                max_workers=min(PAGE_WORKERS, total_pages - 1)
+            ) as executor:
+                # map preserva a ordem das páginas
+                for rows in executor.map(self._fetch_page_rows, range(2, total_pages + 1)):
+                    all_data.extend(rows)
+
+        logger.info(f"Total records fetched: {len(all_data)}")
+
+        if not all_data:
+            logger.warning("No data returned from API")
+            return pd.DataFrame()
+
+        return self._parse_response(all_data)
+
+    def _fetch_page(self, page: int) -> dict:
+        """
+        Busca uma página do relatório síncrono. As novas tentativas (40100/429/5xx e erros
+        de rede) ficam só em _make_request; aqui a falha é propagada direto, sem multiplicar
+        as tentativas sob throttling.
+
+        Args:
+            page: Número da página
+
+        Returns:
+            Bloco 'data' da resposta (list + page_info)
+        """
+        logger.info(f"Fetching page {page} ({self.report_type}, advertiser {self.advertiser_id})")
+        response = self._make_request(
+            endpoint=TIKTOK_REPORT_ENDPOINT,
+            method="GET",
+            params={
+                "advertiser_id": self.advertiser_id,
+                "report_type": "BASIC",
+                "data_level": self._get_data_level(),
+                "dimensions": str(self._get_dimensions()),
+                "metrics": str(self._get_metrics()),
+                "start_date": self.start_date,
+                "end_date": self.end_date,
+                "page": page,
+                "page_size": PAGE_SIZE,
+            },
+        )
+        return response.get("data", {})
+
+    def _fetch_page_rows(self, page: int) -> list:
+        """Retorna só as linhas de uma página."""
+        return self._fetch_page(page).get("list") or []
+
+    def fetch_ad_hierarchy(self) -> pd.DataFrame:
+        """
+        Busca a hierarquia dos ads do advertiser (inclusive removidos) no endpoint de entidades.
+
+        Returns:
+            DataFrame com ad_id, adgroup_id e campaign_id (como texto)
+        """
+        fields = ["ad_id", "adgroup_id", "campaign_id"]
+        rows: list = []
         page = 1
-        page_size = 1000
         total_pages = 1
 
         while page <= total_pages:
-            logger.info(f"Fetching page {page}/{total_pages}")
-
-            payload = self._build_report_payload(page=page, page_size=page_size)
             response = self._make_request(
-                endpoint=TIKTOK_REPORT_ENDPOINT,
+                endpoint=TIKTOK_AD_GET_ENDPOINT,
                 method="GET",
                 params={
                     "advertiser_id": self.advertiser_id,
-                    "report_type": "BASIC",
-                    "data_level": self._get_data_level(),
-                    "dimensions": str(self._get_dimensions()),
-                    "metrics": str(self._get_metrics()),
-                    "start_date": self.start_date,
-                    "end_date": self.end_date,
+                    "fields": json.dumps(fields),
+                    "filtering": json.dumps({"primary_status": "STATUS_ALL"}),
                     "page": page,
-                    "page_size": page_size,
+                    "page_size": PAGE_SIZE,
                 },
             )
-
             data = response.get("data", {})
-            rows = data.get("list", [])
-            page_info = data.get("page_info", {})
+            rows.extend(data.get("list") or [])
+            total_pages = int(data.get("page_info", {}).get("total_page") or 1)
+            page += 1
 
-            if rows:
-                all_data.extend(rows)
+        logger.info(f"Fetched hierarchy of {len(rows)} ads for advertiser {self.advertiser_id}")
+        return pd.DataFrame.from_records(rows, columns=fields).astype(str)
 
-            total_pages = page_info.get("total_page", 1)
-            page += 1
+    def _build_task_payload(self) -> dict:
+        """Payload de criação do report task (mesmos campos do relatório síncrono, sem paginação)."""
+        payload = self._build_report_payload()
+        payload.pop("page")
+        payload.pop("page_size")
+        return payload
 
-            # Pequena pausa para evitar rate limit
-            time.sleep(0.5)
+    def _create_report_task(self) -> str:
+        """
+        Cria o report task assíncrono.
 
-        logger.info(f"Total records fetched: {len(all_data)}")
+        Returns:
+            task_id do relatório
+        """
+        response = self._make_request(
+            endpoint=TIKTOK_REPORT_TASK_CREATE_ENDPOINT,
+            method="POST",
+            json_data=self._build_task_payload(),
+        )
+        task_id = response.get("data", {}).get("task_id")
+        if not task_id:
+            raise Exception(f"Report task sem task_id: {response}")
+        return str(task_id)
 
-        if not all_data:
-            logger.warning("No data returned from API")
+    def _wait_report_task(self, task_id: str) -> None:
+        """
+        Aguarda o report task terminar, com backoff entre as consultas de status.
+
+        Args:
+            task_id: ID do report task
+        """
+        started = time.time()
+        interval = REPORT_TASK_POLL_INTERVAL
+
+        while True:
+            response = self._make_request(
+                endpoint=TIKTOK_REPORT_TASK_CHECK_ENDPOINT,
+                method="GET",
+                params={"advertiser_id": self.advertiser_id, "task_id": task_id},
+            )
+            status = str(response.get("data", {}).get("status", "")).upper()
+            logger.info(f"Report task {task_id} ({self.report_type}): {status}")
+
+            if status == "SUCCESS":
+                return
+            if status in ("FAILED", "CANCELED", "CANCELLED"):
+                raise Exception(f"Report task {task_id} terminou com status {status}")
+            if time.time() - started > REPORT_TASK_TIMEOUT:
+                raise TimeoutError(
+                    f"Report task {task_id} não terminou em {REPORT_TASK_TIMEOUT}s"
+                )
+
+            time.sleep(interval)
+            interval = min(interval * 2, REPORT_TASK_POLL_MAX_INTERVAL)
+
+    def _open_report_file(self, task_id: str) -> requests.Response:
+        """
+        Abre o download do arquivo do report task em modo streaming.
+        A TikTok pode devolver o CSV direto ou um JSON com a URL do arquivo.
+        """
+        self.rate_limiter.acquire(self.advertiser_id)
+        response = self.session.get(
+            f"{self.base_url}{TIKTOK_REPORT_TASK_DOWNLOAD_ENDPOINT}",
+            headers=self.headers,
+            params={"advertiser_id": self.advertiser_id, "task_id": task_id},
+            timeout=120,
+            stream=True,
+        )
+        response.raise_for_status()
+
+        if "application/json" in response.headers.get("Content-Type", ""):
+            data = response.json()
+            if data.get("code") != 0:
+                raise Exception(f"TikTok API error: {data.get('message', 'Unknown error')}")
+            url = data.get("data", {}).get("download_url") or data.get("data", {}).get("url")
+            if not url:
+                raise Exception(f"Report task {task_id} sem arquivo para download: {data}")
+            response = self.session.get(url, timeout=120, stream=True)
+            response.raise_for_status()
+
+        response.raw.decode_content = True
+        return response
+
+    def _iter_task_rows(self, response: requests.Response) -> Iterator[List[dict]]:
+        """
+        Lê o CSV do report task em blocos de REPORT_TASK_CSV_CHUNK_ROWS linhas, convertendo
+        cada bloco para o formato de linha do endpoint síncrono ({dimensions, metrics}).
+        """
+        dimensions = set(self._get_dimensions())
+        text = io.TextIOWrapper(response.raw, encoding="utf-8-sig")
+        reader = pd.read_csv(
+            text,
+            dtype=str,
+            keep_default_na=False,
+            chunksize=REPORT_TASK_CSV_CHUNK_ROWS,
+        )
+        for chunk in reader:
+            yield [
+                {
+                    "dimensions": {k: v for k, v in record.items() if k in dimensions},
+                    "metrics": {k: v for k, v in record.items() if k not in dimensions},
+                }
+                for record in chunk.to_dict("records")
+            ]
+
+    def fetch_report_async(self) -> pd.DataFrame:
+        """
+        Extrai o relatório pela API de report task: cria o task, acompanha o status
+        e baixa o arquivo, convertido em blocos para o mesmo schema de _parse_response.
+
+        Returns:
+            DataFrame com todos os dados do relatório
+        """
+        logger.info(
+            f"Fetching {self.report_type} report (async task) for advertiser {self.advertiser_id}"
+        )
+        logger.info(f"Period: {self.start_date} to {self.end_date}")
+
+        task_id = self._create_report_task()
+        self._wait_report_task(task_id)
+
+        response = self._open_report_file(task_id)
+        try:
+            frames = [self._parse_response(rows) for rows in self._iter_task_rows(response)]
+        finally:
+            response.close()
+
+        frames = [frame for frame in frames if not frame.empty]
+        if not frames:
+            logger.warning("No data returned from report task")
             return pd.DataFrame()
 
-        return self._parse_response(all_data)
+        # os tipos das métricas são os declarados, iguais em todos os blocos
+        df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+        logger.info(f"Total records fetched (async task): {len(df)}")
+        return df
 
     def _parse_response(self, data: list) -> pd.DataFrame:
         """
@@ -232,33 +519,15 @@ class TikTokAdsController:
         if not data:
             return pd.DataFrame()
 
-        records = []
-        for row in data:
-            record = {}
-
-            # Extrai dimensões
-            dimensions = row.get("dimensions", {})
-            for key, value in dimensions.items():
-                record[key] = value
-
-            # Extrai métricas
-            metrics = row.get("metrics", {})
-            for key, value in metrics.items():
-                # Converte valores numéricos
-                if value is not None and value != "":
-                    try:
-                        if "." in str(value):
-                            record[key] = float(value)
-                        else:
-                            record[key] = int(value) if str(value).isdigit() else value
-                    except (ValueError, TypeError):
-                        record[key] = value
-                else:
-                    record[key] = None
-
-            records.append(record)
+        # colunas montadas direto dos dicts; cada métrica é convertida uma vez para o tipo
+        # declarado (campos fora de METRIC_DTYPES, ex.: atributos texto, ficam como vieram)
+        dimensions = pd.DataFrame.from_records([row.get("dimensions") or {} for row in data])
+        metrics = pd.DataFrame.from_records([row.get("metrics") or {} for row in data])
+        for column in metrics.columns:
+            if column in METRIC_DTYPES:
+                metrics[column] = self._cast_metric(metrics[column], METRIC_DTYPES[column])
 
-        df = pd.DataFrame(records)
+        df = pd.concat([dimensions, metrics], axis=1)
 
         # Adiciona metadados
         df["_advertiser_id"] = self.advertiser_id
@@ -273,6 +542,24 @@ class TikTokAdsController:
         logger.info(f"Parsed {len(df)} records into DataFrame")
         return df
 
+    @staticmethod
+    def _cast_metric(values: pd.Series, dtype: str) -> pd.Series:
+        """
+        Converte uma coluna de métrica para o tipo declarado em METRIC_DTYPES.
+        Vazios e valores não numéricos (ex.: "-") viram nulo.
+
+        Args:
+            values: Coluna crua (strings ou números)
+            dtype: "int" ou "float"
+
+        Returns:
+            Coluna Int64 (inteiro com nulos) ou float64
+        """
+        numeric = pd.to_numeric(values, errors="coerce")
+        if dtype == "int":
+            return numeric.round().astype("Int64")
+        return numeric.astype("float64")
+
     def fetch_report_retry(self, max_retries: int = 3) -> pd.DataFrame:
         """
         Extrai relatório com retry em caso de falha.
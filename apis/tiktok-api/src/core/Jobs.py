@@ -0,0 +1,186 @@
+"""
+Jobs Module
+Estado das execuções assíncronas de /run (?async=true): progresso, results por unidade
+e tempos, persistido a cada mudança para que outra instância consiga consultá-lo.
+"""
+
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+# status de um job
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+INTERRUPTED = "interrupted"  # instância encerrada com o job em andamento
+
+FINISHED = (DONE, FAILED, INTERRUPTED)
+
+
+def _now() -> datetime:
+    return datetime.utcnow()
+
+
+class Job:
+    """Execução assíncrona de /run. Cada mudança de estado é persistida com save."""
+
+    def __init__(self, job_id: str, save: Callable[[dict], None]):
+        """
+        Args:
+            job_id: ID do job (também usado como request_id da extração)
+            save: Persiste um snapshot do job
+        """
+        self.job_id = job_id
+        self.status = QUEUED
+        self.created_at = _now()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.units: List[Tuple[str, str]] = []
+        self.results: List[Optional[dict]] = []
+        self.result: Optional[dict] = None
+        self.error: Optional[str] = None
+        self._save = save
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        """Marca o início da execução em background."""
+        with self._lock:
+            self.status = RUNNING
+            self.started_at = _now()
+            self._persist()
+
+    def set_units(self, units: List[Tuple[str, str]]) -> None:
+        """Registra a matriz (advertiser_id, report_type) a processar."""
+        with self._lock:
+            self.units = list(units)
+            self.results = [None] * len(self.units)
+            self._persist()
+
+    def unit_finished(self, index: int, result: dict) -> None:
+        """Registra o result de uma unidade concluída."""
+        with self._lock:
+            self.results[index] = result
+            self._persist()
+
+    def finish(self, result: dict) -> None:
+        """Marca o job como concluído com o resultado de run_extraction."""
+        with self._lock:
+            self.status = DONE
+            self.finished_at = _now()
+            # os results por unidade já estão em self.results
+            self.result = {key: value for key, value in result.items() if key != "results"}
+            self._persist()
+
+    def fail(self, error: str) -> None:
+        """Marca o job como falho (erro fora das unidades, ex.: validação ou BigQuery)."""
+        with self._lock:
+            self.status = FAILED
+            self.finished_at = _now()
+            self.error = error
+            self._persist()
+
+    def save(self) -> None:
+        """Persiste o estado atual do job."""
+        with self._lock:
+            self._persist()
+
+    def snapshot(self) -> dict:
+        """Estado do job no formato retornado por GET /jobs/<id>."""
+        with self._lock:
+            return self._snapshot()
+
+    def _snapshot(self) -> dict:
+        end = self.finished_at or _now()
+        done = [result for result in self.results if result is not None]
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "updated_at": _now().isoformat(),
+            "elapsed_seconds": (
+                round((end - self.started_at).total_seconds(), 1) if self.started_at else 0
+            ),
+            "progress": {
+                "total_units": len(self.units),
+                "finished_units": len(done),
+                "errors_count": sum(1 for result in done if result.get("status") == "error"),
+            },
+            "results": [
+                result or {"advertiser_id": advertiser_id, "report_type": report_type, "status": "pending"}
+                for (advertiser_id, report_type), result in zip(self.units, self.results)
+            ],
+            "result": self.result,
+            "error": self.error,
+        }
+
+    def _persist(self) -> None:
+        # falha ao persistir não interrompe a extração; o estado em memória continua valendo
+        try:
+            self._save(self._snapshot())
+        except Exception as e:
+            logger.warning(f"Job {self.job_id} - falha ao persistir estado: {e}")
+
+
+class JobStore:
+    """
+    Jobs da instância (em memória) com fallback para o estado persistido, usado quando
+    o job foi criado por outra instância ou antes de um restart.
+    """
+
+    def __init__(
+        self,
+        save: Callable[[dict], None],
+        load: Callable[[str], Optional[dict]],
+        stale_after: int,
+    ):
+        """
+        Args:
+            save: Persiste um snapshot de job
+            load: Lê o último snapshot persistido de um job (None se não existir)
+            stale_after: Segundos sem atualização para um job em andamento de outra
+                instância ser reportado como interrompido
+        """
+        self._save = save
+        self._load = load
+        self.stale_after = stale_after
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def create(self) -> Job:
+        """Cria e persiste um job novo (status queued)."""
+        job = Job(str(uuid.uuid4()), self._save)
+        with self._lock:
+            self._jobs[job.job_id] = job
+        job.save()
+        return job
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """
+        Retorna o estado do job.
+
+        Args:
+            job_id: ID do job
+
+        Returns:
+            Snapshot do job ou None se não existir
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job.snapshot()
+
+        snapshot = self._load(job_id)
+        if snapshot is None:
+            return None
+
+        # job de outra instância (ou anterior a um restart) parado há muito tempo
+        updated_at = datetime.fromisoformat(snapshot["updated_at"])
+        if snapshot["status"] not in FINISHED and _now() - updated_at > timedelta(seconds=self.stale_after):
+            snapshot["status"] = INTERRUPTED
+        return snapshot
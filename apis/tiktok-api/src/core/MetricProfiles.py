@@ -0,0 +1,128 @@
+"""
+Metric Profiles Module
+Escolha das métricas pedidas à TikTok por advertiser e report_type (perfis de métricas)
+e poda automática das métricas que vêm sempre zeradas.
+"""
+
+from typing import Dict, Iterable, List, Optional, Set, Union
+
+import pandas as pd
+
+from config.settings import (
+    METRIC_PROFILES,
+    DEFAULT_METRIC_PROFILE,
+    REPORT_TYPE_METRIC_PROFILES,
+    ADVERTISER_METRIC_PROFILES,
+    METRIC_DTYPES,
+    PRUNE_KEEP_METRICS,
+)
+
+Profile = Union[str, List[str]]
+
+
+def profile_metrics(profile: Profile) -> List[str]:
+    """
+    Retorna as métricas de um perfil.
+
+    Args:
+        profile: Nome de um perfil de METRIC_PROFILES ou lista explícita de métricas
+
+    Returns:
+        Lista de métricas, sem repetições
+    """
+    if isinstance(profile, str):
+        if profile not in METRIC_PROFILES:
+            raise ValueError(
+                f"Perfil de métricas inválido: {profile}. Use um de {list(METRIC_PROFILES)}."
+            )
+        return list(METRIC_PROFILES[profile])
+
+    metrics = list(dict.fromkeys(profile))
+    unknown = [metric for metric in metrics if metric not in METRIC_DTYPES]
+    if unknown:
+        raise ValueError(f"Métricas desconhecidas no perfil: {unknown}")
+    if not metrics:
+        raise ValueError("Perfil de métricas vazio.")
+    return metrics
+
+
+class MetricProfiles:
+    """
+    Resolve o perfil de cada unidade: advertiser > report_type > default.
+    Os valores do payload ("metric_profiles") sobrepõem os de config/settings.py.
+    """
+
+    def __init__(self, overrides: Optional[dict] = None):
+        """
+        Args:
+            overrides: {"default": perfil, "report_types": {rt: perfil},
+                "advertisers": {advertiser_id: perfil}}; perfil = nome ou lista de métricas
+        """
+        overrides = overrides or {}
+        self.default: Profile = overrides.get("default", DEFAULT_METRIC_PROFILE)
+        self.report_types: Dict[str, Profile] = {
+            **REPORT_TYPE_METRIC_PROFILES,
+            **(overrides.get("report_types") or {}),
+        }
+        self.advertisers: Dict[str, Profile] = {
+            str(key): value
+            for key, value in {
+                **ADVERTISER_METRIC_PROFILES,
+                **(overrides.get("advertisers") or {}),
+            }.items()
+        }
+
+        # valida tudo antes de começar a extrair
+        for profile in [self.default, *self.report_types.values(), *self.advertisers.values()]:
+            profile_metrics(profile)
+
+    def metrics_for(self, advertiser_id: str, report_type: str) -> List[str]:
+        """Métricas do perfil que vale para o advertiser e report_type."""
+        profile = self.advertisers.get(
+            str(advertiser_id), self.report_types.get(report_type, self.default)
+        )
+        return profile_metrics(profile)
+
+
+def nonzero_metrics(df: pd.DataFrame, metrics: Iterable[str]) -> List[str]:
+    """Métricas com ao menos um valor diferente de zero e de nulo no relatório."""
+    return [
+        metric
+        for metric in metrics
+        if metric in df.columns and (pd.to_numeric(df[metric], errors="coerce").fillna(0) != 0).any()
+    ]
+
+
+def prunable_metrics(history: pd.DataFrame, min_runs: int) -> Set[str]:
+    """
+    Métricas zeradas/nulas nas últimas min_runs execuções em que foram pedidas.
+
+    Args:
+        history: Execuções de um advertiser/report_type (colunas run_at, requested, nonzero)
+        min_runs: Execuções seguidas sem valor necessárias para podar
+
+    Returns:
+        Métricas que podem deixar de ser pedidas (PRUNE_KEEP_METRICS nunca entram)
+    """
+    if history.empty or min_runs < 1:
+        return set()
+
+    runs = history.sort_values("run_at", ascending=False)
+    zero_runs: Dict[str, int] = {}  # execuções seguidas (da mais recente) em que veio zerada
+    seen_nonzero: Set[str] = set()
+
+    for requested, nonzero in zip(runs["requested"], runs["nonzero"]):
+        nonzero = set(nonzero)
+        for metric in requested:
+            if metric in seen_nonzero or zero_runs.get(metric, 0) >= min_runs:
+                continue
+            if metric in nonzero:
+                seen_nonzero.add(metric)
+            else:
+                zero_runs[metric] = zero_runs.get(metric, 0) + 1
+
+    return {
+        str(metric)
+        for metric, count in zero_runs.items()
+        if count >= min_runs and metric not in PRUNE_KEEP_METRICS
+    }
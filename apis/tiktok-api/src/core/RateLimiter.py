@@ -0,0 +1,153 @@
+"""
+Rate Limiter Module
+Token bucket adaptativo para a TikTok Business API, compartilhado por todos os
+workers do processo (limite por app e por advertiser).
+"""
+
+import random
+import threading
+import time
+from typing import Dict
+
+from loguru import logger
+
+APP_KEY = "__app__"
+
+
+class _Bucket:
+    """Estado de um token bucket: taxa atual (tokens/s), teto configurado e bloqueio."""
+
+    def __init__(self, qps: float):
+        self.max_qps = qps
+        self.qps = qps
+        self.capacity = max(1.0, qps)  # rajada máxima = 1s de taxa
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.successes = 0  # sucessos consecutivos desde o último ajuste
+        self.penalties = 0  # 40100 consecutivos (base do backoff exponencial)
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.qps)
+        self.updated_at = now
+
+    def wait_time(self, now: float) -> float:
+        if self.blocked_until > now:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.qps
+
+
+class AdaptiveRateLimiter:
+    """
+    Limita as chamadas por app (todas as chamadas do processo) e por advertiser.
+
+    - acquire() bloqueia o worker até haver token nos dois buckets;
+    - on_rate_limited() (código 40100) reduz a taxa pela metade (até min_qps) e
+      bloqueia o app por um backoff exponencial com jitter;
+    - on_success() devolve a taxa gradualmente (+recovery_step a cada
+      recovery_successes sucessos seguidos) até o teto configurado.
+    """
+
+    def __init__(
+        self,
+        app_qps: float,
+        advertiser_qps: float,
+        min_qps: float = 0.5,
+        recovery_successes: int = 20,
+        recovery_step: float = 0.1,
+        backoff_base: float = 2.0,
+        backoff_max: float = 60.0,
+    ):
+        """
+        Args:
+            app_qps: Chamadas por segundo permitidas para o app
+            advertiser_qps: Chamadas por segundo permitidas por advertiser
+            min_qps: Taxa mínima após reduções
+            recovery_successes: Sucessos seguidos para cada passo de recuperação
+            recovery_step: Fração do teto recuperada a cada passo
+            backoff_base: Bloqueio (s) no primeiro 40100; dobra a cada 40100 seguido
+            backoff_max: Bloqueio máximo (s)
+        """
+        self.app_qps = app_qps
+        self.advertiser_qps = advertiser_qps
+        self.min_qps = min_qps
+        self.recovery_successes = recovery_successes
+        self.recovery_step = recovery_step
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._buckets: Dict[str, _Bucket] = {APP_KEY: _Bucket(app_qps)}
+        self._lock = threading.Lock()
+
+    def _bucket(self, key: str) -> _Bucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(self.advertiser_qps)
+        return bucket
+
+    def acquire(self, advertiser_id: str) -> None:
+        """Aguarda até a chamada do advertiser poder ser feita e consome um token."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                buckets = (self._buckets[APP_KEY], self._bucket(str(advertiser_id)))
+                for bucket in buckets:
+                    bucket.refill(now)
+                wait = max(bucket.wait_time(now) for bucket in buckets)
+                if wait <= 0:
+                    for bucket in buckets:
+                        bucket.tokens -= 1
+                    return
+            time.sleep(wait)
+
+    def on_success(self, advertiser_id: str) -> None:
+        """Registra uma chamada bem-sucedida (recuperação gradual da taxa)."""
+        with self._lock:
+            for bucket in (self._buckets[APP_KEY], self._bucket(str(advertiser_id))):
+                bucket.penalties = 0
+                bucket.successes += 1
+                if bucket.qps < bucket.max_qps and bucket.successes >= self.recovery_successes:
+                    bucket.qps = min(bucket.max_qps, bucket.qps + bucket.max_qps * self.recovery_step)
+                    bucket.successes = 0
+
+    def on_rate_limited(self, advertiser_id: str) -> float:
+        """
+        Registra um 40100: reduz a taxa do app e do advertiser e bloqueia o app inteiro
+        (o limite do TikTok é por app) com backoff exponencial + jitter.
+
+        Args:
+            advertiser_id: Advertiser da chamada limitada
+
+        Returns:
+            Segundos de bloqueio aplicados
+        """
+        with self._lock:
+            now = time.monotonic()
+            app = self._buckets[APP_KEY]
+            advertiser = self._bucket(str(advertiser_id))
+
+            if app.blocked_until > now:
+                # outro worker já reduziu a taxa e aplicou o backoff deste episódio de 40100
+                return app.blocked_until - now
+
+            for bucket in (app, advertiser):
+                bucket.qps = max(self.min_qps, bucket.qps / 2)
+                bucket.successes = 0
+                bucket.tokens = min(bucket.tokens, 0.0)
+
+            delay = min(self.backoff_max, self.backoff_base * 2 ** app.penalties)
+            delay *= random.uniform(0.5, 1.5)  # jitter: workers não voltam todos juntos
+            app.penalties += 1
+            app.blocked_until = now + delay
+
+        logger.info(
+            f"Rate limit (40100) advertiser {advertiser_id}: taxa reduzida para "
+            f"{advertiser.qps:.2f} qps (app {app.qps:.2f}), aguardando {delay:.1f}s"
+        )
+        return delay
+
+    @staticmethod
+    def backoff(attempt: int, base: float = 1.0, maximum: float = 30.0) -> float:
+        """Espera exponencial com jitter para erros que não são de rate limit."""
+        return min(maximum, base * 2 ** attempt) * random.uniform(0.5, 1.5)
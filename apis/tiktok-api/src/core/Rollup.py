@@ -0,0 +1,132 @@
+"""
+Rollup Module
+Agrega localmente as métricas aditivas do relatório ad-level para os níveis
+advertiser, campaign e adgroup (modo rollup).
+"""
+
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+import pandas as pd
+
+from config.settings import ADDITIVE_METRICS, DIMENSIONS, METRICS
+
+METADATA_COLUMNS = ["_advertiser_id", "_extracted_at", "_report_type", "date"]
+
+
+class RollupError(Exception):
+    """O rollup não cobre o relatório (ex.: ads sem hierarquia); o nível deve ser extraído da API."""
+
+
+class RunCache:
+    """
+    Resultados calculados uma única vez por execução e compartilhados entre as unidades
+    (ex.: relatório ad-level de um advertiser usado pelos níveis superiores).
+    Um erro também é guardado: as demais unidades falham sem repetir a chamada.
+    """
+
+    def __init__(self):
+        self._entries: Dict[Hashable, Tuple[Any, Optional[Exception]]] = {}
+        self._locks: Dict[Hashable, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        """
+        Retorna o valor da chave, calculando-o com factory na primeira chamada.
+
+        Args:
+            key: Chave do resultado
+            factory: Função que calcula o resultado
+
+        Returns:
+            Resultado de factory
+        """
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+
+        with lock:
+            if key not in self._entries:
+                try:
+                    self._entries[key] = (factory(), None)
+                except Exception as e:
+                    self._entries[key] = (None, e)
+
+        value, error = self._entries[key]
+        if error is not None:
+            raise error
+        return value
+
+
+def rollup_report(
+    ad_df: pd.DataFrame,
+    hierarchy: Optional[pd.DataFrame],
+    level_df: pd.DataFrame,
+    report_type: str,
+    advertiser_id: str,
+    metrics: List[str],
+) -> pd.DataFrame:
+    """
+    Monta o relatório de um nível superior: soma das métricas aditivas do ad-level
+    por entidade e dia, combinada com as métricas não aditivas extraídas do nível.
+
+    Args:
+        ad_df: Relatório ad-level (métricas do perfil do nível ad)
+        hierarchy: ad_id -> adgroup_id, campaign_id (não usado no nível advertiser)
+        level_df: Relatório do nível só com as métricas não aditivas
+        report_type: advertiser, campaign ou adgroup
+        advertiser_id: ID do anunciante
+        metrics: Métricas pedidas para o nível (perfil da unidade)
+
+    Returns:
+        DataFrame no mesmo formato da extração direta do nível
+    """
+    key = DIMENSIONS[report_type][0]
+    additive = [metric for metric in ADDITIVE_METRICS if metric in metrics]
+    missing = [metric for metric in additive if metric not in ad_df.columns]
+    if missing and not ad_df.empty:
+        raise RollupError(f"métricas aditivas ausentes do relatório ad-level: {missing}")
+
+    if ad_df.empty:
+        sums = pd.DataFrame(columns=[key, "stat_time_day"])
+    elif report_type == "advertiser":
+        sums = ad_df[["stat_time_day"] + additive].assign(**{key: advertiser_id})
+    else:
+        rows = ad_df[["ad_id", "stat_time_day"] + additive].merge(
+            hierarchy[["ad_id", key]], on="ad_id", how="left"
+        )
+        unmapped = rows[key].isna()
+        if unmapped.any():
+            unmapped_ads = rows.loc[unmapped, "ad_id"].nunique()
+            raise RollupError(f"{unmapped_ads} ad(s) sem {key} na hierarquia")
+        sums = rows.drop(columns="ad_id")
+
+    if not sums.empty:
+        sums = sums.groupby([key, "stat_time_day"], as_index=False, sort=False).sum(min_count=1)
+
+    if level_df.empty:
+        df = sums
+    else:
+        df = level_df.merge(sums, on=[key, "stat_time_day"], how="outer")
+
+    if df.empty:
+        return pd.DataFrame()
+
+    # linhas que só existem no rollup recebem os metadados que _parse_response adicionaria
+    df["_advertiser_id"] = advertiser_id
+    df["_report_type"] = report_type
+    if "_extracted_at" in df.columns:
+        df["_extracted_at"] = df["_extracted_at"].fillna(datetime.utcnow().isoformat())
+    else:
+        df["_extracted_at"] = datetime.utcnow().isoformat()
+    df["date"] = pd.to_datetime(df["stat_time_day"]).dt.date.astype(str)
+
+    return df[_column_order(df.columns, report_type)]
+
+
+def _column_order(columns: pd.Index, report_type: str) -> List[str]:
+    """Dimensões, métricas (ordem de METRICS) e metadados, como na extração direta."""
+    ordered = [column for column in DIMENSIONS[report_type] if column in columns]
+    ordered += [metric for metric in METRICS if metric in columns]
+    ordered += [column for column in columns if column not in ordered and column not in METADATA_COLUMNS]
+    return ordered + [column for column in METADATA_COLUMNS if column in columns]
@@ -0,0 +1 @@
+"""Core package for TikTok Ads API."""
@@ -8,6 +8,7 @@ Autor: Data Engineering Team
 Data: Janeiro 2025
 """
 
+import time
 from datetime import datetime, timedelta
 from typing import Any
 
@@ -35,6 +36,9 @@ TIKTOK_ADVERTISER_IDS = Variable.get(
     deserialize_json=True
 )
 
+# Acompanhamento do job assíncrono (/run?async=true + GET /jobs/<id>)
+JOB_POLL_INTERVAL = 30  # segundos entre consultas de status
+
 
 default_args = {
     "owner": "data-engineering",
@@ -136,29 +140,51 @@ def tiktok_ads_extraction():
         """
         Chama a API TikTok Ads no Cloud Run.
         
+        Dispara a extração como job assíncrono (/run?async=true) e acompanha
+        o status em /jobs/<id> até o fim, sem manter uma conexão HTTP aberta.
         Utiliza autenticação OIDC para Cloud Run privado.
         """
-        # Gera token OIDC
-        token = get_oidc_token(CLOUD_RUN_URL)
-
-        headers = {
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json",
-        }
 
-        url = f"{CLOUD_RUN_URL}/run"
+        def headers() -> dict:
+            # token gerado a cada chamada: o job pode durar mais que a validade do token
+            return {
+                "Authorization": f"Bearer {get_oidc_token(CLOUD_RUN_URL)}",
+                "Content-Type": "application/json",
+            }
 
         response = requests.post(
-            url,
+            f"{CLOUD_RUN_URL}/run",
+            params={"async": "true"},
             json=payload,
-            headers=headers,
-            timeout=600,  # 10 minutos
+            headers=headers(),
+            timeout=60,
         )
-
         response.raise_for_status()
-        result = response.json()
-
-        return result
+        job_id = response.json()["job_id"]
+        print(f"Job {job_id} aceito")
+
+        while True:
+            time.sleep(JOB_POLL_INTERVAL)
+            response = requests.get(
+                f"{CLOUD_RUN_URL}/jobs/{job_id}",
+                headers=headers(),
+                timeout=60,
+            )
+            response.raise_for_status()
+            job = response.json()
+
+            progress = job.get("progress", {})
+            print(
+                f"Job {job_id}: {job.get('status')} - "
+                f"{progress.get('finished_units', 0)}/{progress.get('total_units', 0)} unidades "
+                f"({job.get('elapsed_seconds', 0)}s)"
+            )
+
+            if job.get("status") == "done":
+                return {**job["result"], "results": job.get("results", [])}
+            if job.get("status") in ("failed", "interrupted"):
+                # falha da task: o Airflow dispara um novo job nas retries
+                raise Exception(f"Job {job_id} {job.get('status')}: {job.get('error')}")
 
     @task(task_id="validate_result")
     def validate_result(result: dict) -> dict:
@@ -3,12 +3,19 @@ BigQuery Database Module
 Responsável pela conexão e exportação de dados para BigQuery
 """
 
-from typing import Optional
+import json
+from typing import List, Optional
+from google.api_core.exceptions import NotFound
 from google.cloud import bigquery
 from google.oauth2 import service_account
 from loguru import logger
 import pandas as pd
 
+from config.settings import METRIC_DTYPES
+
+# tipo no BigQuery de cada tipo de METRIC_DTYPES
+BQ_METRIC_TYPES = {"int": "INTEGER", "float": "FLOAT"}
+
 class BigQuery:
     """Classe para interação com Google BigQuery"""
 
@@ -27,6 +34,7 @@ class BigQuery:
         self.project_id = project_id
         self.credentials_path = credentials_path
         self.client: Optional[bigquery.Client] = None
+        self._ready_tables: set = set()
 
     def auth(self) -> None:
         """
@@ -133,12 +141,23 @@ class BigQuery:
                     advertiser_id=advertiser_id,
                 )
 
-            # Configura job de carga
+            # Configura job de carga: métricas com o tipo de METRIC_DTYPES (mesmo tipo em
+            # toda carga); no append, colunas novas (ex.: métrica que volta depois de podada
+            # ou de mudança de perfil) são adicionadas à tabela em vez de falhar a carga
+            append = if_exists != "replace"
             job_config = bigquery.LoadJobConfig(
                 write_disposition=(
-                    bigquery.WriteDisposition.WRITE_TRUNCATE
-                    if if_exists == "replace"
-                    else bigquery.WriteDisposition.WRITE_APPEND
+                    bigquery.WriteDisposition.WRITE_APPEND
+                    if append
+                    else bigquery.WriteDisposition.WRITE_TRUNCATE
+                ),
+                schema=[
+                    bigquery.SchemaField(column, BQ_METRIC_TYPES[METRIC_DTYPES[column]])
+                    for column in df.columns
+                    if column in METRIC_DTYPES
+                ],
+                schema_update_options=(
+                    [bigquery.SchemaUpdateOption.ALLOW_FIELD_ADDITION] if append else None
                 ),
                 autodetect=True,
             )
@@ -168,6 +187,150 @@ class BigQuery:
             logger.error(f"BigQuery export failed: {e}")
             raise
 
+    def metric_usage(
+        self,
+        usage_table: str,
+        advertiser_ids: List[str],
+        days: int,
+    ) -> pd.DataFrame:
+        """
+        Lê o histórico de métricas pedidas/não zeradas por execução (poda automática).
+
+        Args:
+            usage_table: Tabela de histórico (dataset.table)
+            advertiser_ids: Anunciantes da execução
+            days: Janela de histórico em dias
+
+        Returns:
+            DataFrame com advertiser_id, report_type, run_at, requested e nonzero
+        """
+        query = f"""
+        SELECT advertiser_id, report_type, run_at, requested, nonzero
+        FROM `{self.project_id}.{usage_table}`
+        WHERE run_at >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL @days DAY)
+        AND advertiser_id IN UNNEST(@advertiser_ids)
+        """
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ScalarQueryParameter("days", "INT64", days),
+                bigquery.ArrayQueryParameter("advertiser_ids", "STRING", advertiser_ids),
+            ]
+        )
+
+        if self.client is None:
+            raise ValueError("BigQuery client not initialized. Call auth() first.")
+        try:
+            return self.client.query(query, job_config=job_config).to_dataframe()
+        except NotFound:
+            # primeira execução com poda: ainda não há histórico
+            logger.info(f"Metric usage table {usage_table} not found. No history yet.")
+            return pd.DataFrame(
+                columns=["advertiser_id", "report_type", "run_at", "requested", "nonzero"]
+            )
+
+    def record_metric_usage(self, usage_table: str, rows: List[dict]) -> None:
+        """
+        Grava as métricas pedidas/não zeradas de cada unidade da execução, num único job.
+
+        Args:
+            usage_table: Tabela de histórico (dataset.table), criada se não existir
+            rows: Registros com advertiser_id, report_type, request_id, run_at,
+                requested e nonzero
+        """
+        if not rows:
+            return
+
+        job_config = bigquery.LoadJobConfig(
+            schema=[
+                bigquery.SchemaField("advertiser_id", "STRING"),
+                bigquery.SchemaField("report_type", "STRING"),
+                bigquery.SchemaField("request_id", "STRING"),
+                bigquery.SchemaField("run_at", "TIMESTAMP"),
+                bigquery.SchemaField("requested", "STRING", mode="REPEATED"),
+                bigquery.SchemaField("nonzero", "STRING", mode="REPEATED"),
+            ],
+            write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+        )
+
+        if self.client is None:
+            raise ValueError("BigQuery client not initialized. Call auth() first.")
+        job = self.client.load_table_from_json(
+            rows,
+            f"{self.project_id}.{usage_table}",
+            job_config=job_config,
+        )
+        job.result()
+        logger.info(f"Recorded metric usage of {len(rows)} units in {usage_table}")
+
+    def save_job(self, jobs_table: str, snapshot: dict) -> None:
+        """
+        Grava um snapshot de job assíncrono (append-only; o estado vigente é o mais recente).
+
+        Args:
+            jobs_table: Tabela de jobs (dataset.table), criada se não existir
+            snapshot: Estado do job (Job.snapshot)
+        """
+        if self.client is None:
+            raise ValueError("BigQuery client not initialized. Call auth() first.")
+
+        full_table_id = f"{self.project_id}.{jobs_table}"
+        if full_table_id not in self._ready_tables:
+            table = bigquery.Table(
+                full_table_id,
+                schema=[
+                    bigquery.SchemaField("job_id", "STRING", mode="REQUIRED"),
+                    bigquery.SchemaField("status", "STRING"),
+                    bigquery.SchemaField("updated_at", "TIMESTAMP"),
+                    bigquery.SchemaField("state", "STRING"),
+                ],
+            )
+            table.time_partitioning = bigquery.TimePartitioning(field="updated_at")
+            self.client.create_table(table, exists_ok=True)
+            self._ready_tables.add(full_table_id)
+
+        # streaming insert: o snapshot fica consultável na hora (load job teria cota diária)
+        errors = self.client.insert_rows_json(
+            full_table_id,
+            [{
+                "job_id": snapshot["job_id"],
+                "status": snapshot["status"],
+                "updated_at": snapshot["updated_at"],
+                "state": json.dumps(snapshot, default=str),
+            }],
+        )
+        if errors:
+            raise RuntimeError(f"Insert into {full_table_id} failed: {errors}")
+
+    def load_job(self, jobs_table: str, job_id: str) -> Optional[dict]:
+        """
+        Lê o snapshot mais recente de um job assíncrono.
+
+        Args:
+            jobs_table: Tabela de jobs (dataset.table)
+            job_id: ID do job
+
+        Returns:
+            Estado do job ou None se não existir
+        """
+        query = f"""
+        SELECT state
+        FROM `{self.project_id}.{jobs_table}`
+        WHERE job_id = @job_id
+        ORDER BY updated_at DESC
+        LIMIT 1
+        """
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[bigquery.ScalarQueryParameter("job_id", "STRING", job_id)]
+        )
+
+        if self.client is None:
+            raise ValueError("BigQuery client not initialized. Call auth() first.")
+        try:
+            rows = list(self.client.query(query, job_config=job_config).result())
+        except NotFound:
+            return None
+        return json.loads(rows[0]["state"]) if rows else None
+
     def table_exists(self, destination_table: str) -> bool:
         """
         Verifica se tabela existe.
@@ -6,21 +6,57 @@ Suporta 4 níveis de relatório: advertiser, campaign, adgroup, ad.
 """
 
 import os
+import sys
+import threading
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
-from typing import Any
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
+import pandas as pd
+import requests
 from flask import Flask, jsonify, request
+from google.api_core.exceptions import Unauthorized
+from google.auth.exceptions import RefreshError
 from loguru import logger
 
+# Adiciona apis/ ao path (shared)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+
 from config.settings import (
     PROJECT_ID,
     DATASET_ID,
     TABLES,
     DEFAULT_DAYS_REPROCESS,
+    DEFAULT_MAX_WORKERS,
+    DEFAULT_MAX_WORKERS_PER_ADVERTISER,
+    DEFAULT_REPORT_MODE,
+    REPORT_MODES,
+    TIKTOK_APP_QPS,
+    TIKTOK_ADVERTISER_QPS,
+    NON_ADDITIVE_METRICS,
+    DEFAULT_ROLLUP,
+    DEFAULT_PRUNE_METRICS,
+    PRUNE_ZERO_RUNS,
+    PRUNE_RECHECK_DAYS,
+    PRUNE_KEEP_METRICS,
+    METRIC_USAGE_TABLE,
+    JOBS_TABLE,
+    JOB_WORKERS,
+    JOB_STALE_AFTER,
+)
+from controller.TikTokAdsController import (
+    TikTokAdsController,
+    build_session,
+    shared_rate_limiter,
 )
-from controller.TikTokAdsController import TikTokAdsController
+from core.Jobs import Job, JobStore
+from core.MetricProfiles import MetricProfiles, nonzero_metrics, prunable_metrics
+from core.RateLimiter import AdaptiveRateLimiter
+from core.Rollup import RollupError, RunCache, rollup_report
 from database.BigQuery import BigQuery
+from shared.registry import registry
 
 app = Flask(__name__)
 
@@ -49,17 +85,271 @@ def get_env_int(*keys: str, default: int) -> int:
     return default
 
 
-def run_extraction(payload: dict) -> dict:
+def get_env_float(*keys: str, default: float) -> float:
+    """Retorna variável de ambiente como float."""
+    for k in keys:
+        v = os.environ.get(k)
+        if v is not None and str(v).strip() != "":
+            return float(v)
+    return default
+
+
+def get_bigquery(project_id: str) -> BigQuery:
+    """
+    Retorna o BigQuery autenticado do projeto, reaproveitado enquanto a instância estiver quente.
+
+    Args:
+        project_id: ID do projeto GCP
+
+    Returns:
+        Instância autenticada de BigQuery
+    """
+
+    def create() -> BigQuery:
+        bq = BigQuery(project_id=project_id)
+        bq.auth()
+        return bq
+
+    return registry.get("bigquery", project_id, create)
+
+
+def fetch_unit(
+    tiktok: TikTokAdsController,
+    run_cache: Optional[RunCache],
+    create: Callable[..., TikTokAdsController],
+) -> pd.DataFrame:
+    """
+    Extrai o relatório de uma unidade. No modo rollup (run_cache informado), o relatório
+    ad-level do advertiser é buscado uma única vez por execução; os níveis superiores somam
+    dele as métricas aditivas e pedem à API só as não aditivas.
+
+    Args:
+        tiktok: Controller da unidade
+        run_cache: Cache da execução (None = extração direta do nível)
+        create: Cria um controller do mesmo advertiser (report_type, metrics opcional;
+            default = métricas do perfil da unidade)
+
+    Returns:
+        DataFrame do relatório
+    """
+    if run_cache is None:
+        return tiktok.fetch_report_retry()
+
+    advertiser_id = tiktok.advertiser_id
+    ad = create(report_type="ad")
+    ad_df = run_cache.get(("ad_report", advertiser_id), ad.fetch_report_retry)
+    if tiktok.report_type == "ad":
+        return ad_df
+
+    hierarchy = None
+    if tiktok.report_type != "advertiser" and not ad_df.empty:
+        hierarchy = run_cache.get(("ad_hierarchy", advertiser_id), ad.fetch_ad_hierarchy)
+
+    metrics = tiktok.requested_metrics
+    non_additive = [metric for metric in metrics if metric in NON_ADDITIVE_METRICS]
+    level_df = (
+        create(report_type=tiktok.report_type, metrics=non_additive).fetch_report_retry()
+        if non_additive
+        else pd.DataFrame()
+    )
+    try:
+        return rollup_report(
+            ad_df, hierarchy, level_df, tiktok.report_type, advertiser_id, metrics
+        )
+    except RollupError as e:
+        logger.warning(
+            f"Rollup indisponível para {tiktok.report_type} (advertiser: {advertiser_id}): "
+            f"{e}. Extraindo o nível completo da API"
+        )
+        return tiktok.fetch_report_retry()
+
+
+def process_unit(
+    request_id: str,
+    bq: BigQuery,
+    session: requests.Session,
+    rate_limiter: AdaptiveRateLimiter,
+    access_token: str,
+    advertiser_id: str,
+    report_type: str,
+    project_id: str,
+    dataset_id: str,
+    start_date: str,
+    end_date: str,
+    if_exists: str,
+    report_mode: str = DEFAULT_REPORT_MODE,
+    run_cache: Optional[RunCache] = None,
+    metrics_for: Optional[Callable[[str, str], List[str]]] = None,
+    usage: Optional[List[dict]] = None,
+) -> dict:
+    """
+    Extrai e carrega um report_type de um advertiser.
+    Nunca propaga exceções: o erro vira uma entrada de results, isolando as demais unidades.
+    Com run_cache, usa o modo rollup (ver fetch_unit). metrics_for escolhe as métricas
+    por (advertiser_id, report_type); em usage são registradas as métricas pedidas e as
+    que vieram com valor (poda automática).
+
+    Returns:
+        Entrada de results da unidade
+    """
+    destination_table = f"{dataset_id}.{TABLES[report_type]}"
+    logger.info(
+        f"{request_id} - Extraindo {report_type} (advertiser: {advertiser_id}) "
+        f"para {destination_table}"
+    )
+
+    def create(report_type: str, metrics: Optional[List[str]] = None) -> TikTokAdsController:
+        if metrics is None and metrics_for is not None:
+            metrics = metrics_for(advertiser_id, report_type)
+        return TikTokAdsController(
+            access_token=access_token,
+            advertiser_id=advertiser_id,
+            start_date=start_date,
+            end_date=end_date,
+            report_type=report_type,
+            session=session,
+            report_mode=report_mode,
+            rate_limiter=rate_limiter,
+            metrics=metrics,
+        )
+
+    try:
+        # Inicializa controller TikTok
+        tiktok = create(report_type=report_type)
+
+        # Extrai dados
+        df = fetch_unit(tiktok, run_cache, create)
+
+        if df.empty:
+            logger.warning(
+                f"{request_id} - Sem dados para {report_type} "
+                f"(advertiser: {advertiser_id})"
+            )
+            return {
+                "advertiser_id": advertiser_id,
+                "report_type": report_type,
+                "destination_table": destination_table,
+                "inserted_rows": 0,
+                "metrics_count": len(tiktok.requested_metrics),
+                "status": "empty",
+            }
+
+        if usage is not None:
+            requested = tiktok.requested_metrics
+            usage.append({
+                "advertiser_id": advertiser_id,
+                "report_type": report_type,
+                "requested": requested,
+                "nonzero": nonzero_metrics(df, requested),
+            })
+
+        # Exporta para BigQuery
+        inserted = bq.export(
+            df=df,
+            destination_table=destination_table,
+            start_date=start_date,
+            end_date=end_date,
+            advertiser_id=advertiser_id,
+            if_exists=if_exists,
+        )
+
+        return {
+            "advertiser_id": advertiser_id,
+            "report_type": report_type,
+            "destination_table": destination_table,
+            "inserted_rows": inserted,
+            "metrics_count": len(tiktok.requested_metrics),
+            "status": "success",
+        }
+
+    except Exception as e:
+        logger.error(
+            f"{request_id} - Erro ao processar {report_type} "
+            f"(advertiser: {advertiser_id}): {e}"
+        )
+        if isinstance(e, (RefreshError, Unauthorized)):
+            # credencial do BigQuery inválida: recria o cliente na próxima requisição
+            registry.invalidate("bigquery", project_id)
+        return {
+            "advertiser_id": advertiser_id,
+            "report_type": report_type,
+            "destination_table": destination_table,
+            "inserted_rows": 0,
+            "status": "error",
+            "error": str(e),
+        }
+
+
+def run_units(
+    units: List[Tuple[str, str]],
+    process: Callable[[str, str], dict],
+    max_workers: int,
+    max_workers_per_advertiser: int,
+    on_result: Optional[Callable[[int, dict], None]] = None,
+) -> List[dict]:
+    """
+    Executa a matriz (advertiser_id, report_type) com concorrência limitada:
+    no máximo max_workers unidades ao mesmo tempo no total e
+    max_workers_per_advertiser por advertiser.
+
+    Args:
+        units: Lista de (advertiser_id, report_type)
+        process: Função que processa uma unidade e retorna sua entrada de results
+        max_workers: Limite global de unidades simultâneas
+        max_workers_per_advertiser: Limite de unidades simultâneas por advertiser
+        on_result: Chamada a cada unidade concluída com (índice em units, result)
+
+    Returns:
+        Entradas de results na mesma ordem de units
+    """
+    if not units:
+        return []
+
+    limits = {
+        advertiser_id: threading.BoundedSemaphore(max(1, max_workers_per_advertiser))
+        for advertiser_id, _ in units
+    }
+
+    def run(index: int) -> dict:
+        advertiser_id, report_type = units[index]
+        with limits[advertiser_id]:
+            started = time.monotonic()
+            result = process(advertiser_id, report_type)
+        result["elapsed_seconds"] = round(time.monotonic() - started, 1)
+        return result
+
+    # submete intercalando advertisers (1º report de cada, depois o 2º...) para
+    # que os workers raramente fiquem parados no limite por advertiser
+    position = {}
+    rank = []
+    for index, (advertiser_id, _) in enumerate(units):
+        rank.append((position.get(advertiser_id, 0), index))
+        position[advertiser_id] = position.get(advertiser_id, 0) + 1
+    order = [index for _, index in sorted(rank)]
+
+    results: List[Optional[dict]] = [None] * len(units)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(units)))) as executor:
+        futures = {executor.submit(run, index): index for index in order}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+            if on_result is not None:
+                on_result(futures[future], results[futures[future]])
+
+    return results
+
+
+def run_extraction(payload: dict, job: Optional[Job] = None) -> dict:
     """
     Executa extração de dados TikTok Ads para BigQuery.
 
     Args:
         payload: Parâmetros da requisição
+        job: Job assíncrono que acompanha a execução (progresso por unidade)
 
     Returns:
         Resultado da execução
     """
-    request_id = str(uuid.uuid4())
+    request_id = job.job_id if job else str(uuid.uuid4())
     logger.info(f"{request_id} - Iniciando extração TikTok Ads -> BigQuery")
 
     # Configurações de ambiente
@@ -79,6 +369,20 @@ def run_extraction(payload: dict) -> dict:
         payload, "report_types", ["advertiser", "campaign", "adgroup", "ad"]
     )
 
+    # "sync" (paginação) ou "async" (report task; indicado para ad em janelas longas)
+    report_mode = get_optional(payload, "report_mode", DEFAULT_REPORT_MODE)
+    if report_mode not in REPORT_MODES:
+        raise ValueError(f"report_mode inválido: {report_mode}. Use um de {REPORT_MODES}.")
+
+    # rollup: ad-level uma vez por advertiser, métricas aditivas somadas localmente
+    rollup = bool(get_optional(payload, "rollup", DEFAULT_ROLLUP))
+    run_cache = RunCache() if rollup else None
+
+    # perfis de métricas (settings + payload) e poda automática das sempre zeradas
+    profiles = MetricProfiles(get_optional(payload, "metric_profiles"))
+    prune = bool(get_optional(payload, "prune_metrics", DEFAULT_PRUNE_METRICS))
+    prune_runs = int(get_optional(payload, "prune_runs", PRUNE_ZERO_RUNS))
+
     # Datas
     start_date = get_optional(payload, "start_date", "")
     end_date = get_optional(payload, "end_date", "")
@@ -97,93 +401,114 @@ def run_extraction(payload: dict) -> dict:
     logger.info(f"{request_id} - Período: {start_date} a {end_date}")
     logger.info(f"{request_id} - Advertisers: {advertiser_ids}")
     logger.info(f"{request_id} - Report types: {report_types}")
+    if rollup:
+        logger.info(f"{request_id} - Modo rollup: métricas aditivas somadas do nível ad")
 
-    # Inicializa BigQuery
-    bq = BigQuery(project_id=project_id)
-    bq.auth()
-
-    results = []
-
-    for advertiser_id in advertiser_ids:
-        advertiser_id = str(advertiser_id).replace("-", "").strip()
-        logger.info(f"{request_id} - Processando advertiser: {advertiser_id}")
-
-        for report_type in report_types:
-            if report_type not in TABLES:
-                logger.warning(f"Report type '{report_type}' não suportado. Ignorando.")
-                continue
+    # BigQuery e sessão HTTP vivem na instância (reaproveitados entre requisições)
+    bq = get_bigquery(project_id)
+    session = registry.get("tiktok_session", "default", build_session)
 
-            table_name = TABLES[report_type]
-            destination_table = f"{dataset_id}.{table_name}"
-
-            logger.info(
-                f"{request_id} - Extraindo {report_type} para {destination_table}"
-            )
+    # um único limitador por processo: todos os workers dividem o QPS do app
+    rate_limiter = shared_rate_limiter(
+        app_qps=get_env_float("TIKTOK_APP_QPS", default=TIKTOK_APP_QPS),
+        advertiser_qps=get_env_float("TIKTOK_ADVERTISER_QPS", default=TIKTOK_ADVERTISER_QPS),
+    )
 
-            try:
-                # Inicializa controller TikTok
-                tiktok = TikTokAdsController(
-                    access_token=access_token,
-                    advertiser_id=advertiser_id,
-                    start_date=start_date,
-                    end_date=end_date,
-                    report_type=report_type,
-                )
+    max_workers = int(
+        get_optional(payload, "max_workers", get_env_int("MAX_WORKERS", default=DEFAULT_MAX_WORKERS))
+    )
+    max_workers_per_advertiser = int(
+        get_optional(
+            payload,
+            "max_workers_per_advertiser",
+            get_env_int("MAX_WORKERS_PER_ADVERTISER", default=DEFAULT_MAX_WORKERS_PER_ADVERTISER),
+        )
+    )
 
-                # Extrai dados
-                df = tiktok.fetch_report_retry()
-
-                if df.empty:
-                    logger.warning(
-                        f"{request_id} - Sem dados para {report_type} "
-                        f"(advertiser: {advertiser_id})"
-                    )
-                    results.append(
-                        {
-                            "advertiser_id": advertiser_id,
-                            "report_type": report_type,
-                            "destination_table": destination_table,
-                            "inserted_rows": 0,
-                            "status": "empty",
-                        }
-                    )
-                    continue
-
-                # Exporta para BigQuery
-                inserted = bq.export(
-                    df=df,
-                    destination_table=destination_table,
-                    start_date=start_date,
-                    end_date=end_date,
-                    advertiser_id=advertiser_id,
-                    if_exists=if_exists,
+    usage_table = f"{dataset_id}.{METRIC_USAGE_TABLE}"
+    pruned: Dict[Tuple[str, str], Set[str]] = {}
+    usage: Optional[List[dict]] = None
+    if prune:
+        history = bq.metric_usage(
+            usage_table,
+            [str(advertiser_id).replace("-", "").strip() for advertiser_id in advertiser_ids],
+            PRUNE_RECHECK_DAYS,
+        )
+        for (advertiser_id, report_type), group in history.groupby(["advertiser_id", "report_type"]):
+            pruned[(advertiser_id, report_type)] = prunable_metrics(group, prune_runs)
+            if pruned[(advertiser_id, report_type)]:
+                logger.info(
+                    f"{request_id} - {report_type} (advertiser: {advertiser_id}): "
+                    f"{len(pruned[(advertiser_id, report_type)])} métricas zeradas podadas"
                 )
+        usage = []
+
+    def metrics_for(advertiser_id: str, report_type: str) -> List[str]:
+        skip = pruned.get((advertiser_id, report_type), set())
+        metrics = [
+            metric
+            for metric in profiles.metrics_for(advertiser_id, report_type)
+            if metric not in skip
+        ]
+        # perfil todo podado: sem métricas o controller pediria METRICS inteiro;
+        # pede só as que nunca são podadas
+        return metrics or list(PRUNE_KEEP_METRICS)
+
+    for report_type in report_types:
+        if report_type not in TABLES:
+            logger.warning(f"Report type '{report_type}' não suportado. Ignorando.")
+
+    # matriz advertiser x report_type (ordem original preservada nos results)
+    units = [
+        (str(advertiser_id).replace("-", "").strip(), report_type)
+        for advertiser_id in advertiser_ids
+        for report_type in report_types
+        if report_type in TABLES
+    ]
+
+    if job is not None:
+        job.set_units(units)
+
+    logger.info(
+        f"{request_id} - {len(units)} extrações com até {max_workers} em paralelo "
+        f"({max_workers_per_advertiser} por advertiser)"
+    )
 
-                results.append(
-                    {
-                        "advertiser_id": advertiser_id,
-                        "report_type": report_type,
-                        "destination_table": destination_table,
-                        "inserted_rows": inserted,
-                        "status": "success",
-                    }
-                )
+    results = run_units(
+        units,
+        lambda advertiser_id, report_type: process_unit(
+            request_id=request_id,
+            bq=bq,
+            session=session,
+            rate_limiter=rate_limiter,
+            access_token=access_token,
+            advertiser_id=advertiser_id,
+            report_type=report_type,
+            project_id=project_id,
+            dataset_id=dataset_id,
+            start_date=start_date,
+            end_date=end_date,
+            if_exists=if_exists,
+            report_mode=report_mode,
+            run_cache=run_cache,
+            metrics_for=metrics_for,
+            usage=usage,
+        ),
+        max_workers=max_workers,
+        max_workers_per_advertiser=max_workers_per_advertiser,
+        on_result=job.unit_finished if job else None,
+    )
 
-            except Exception as e:
-                logger.error(
-                    f"{request_id} - Erro ao processar {report_type} "
-                    f"(advertiser: {advertiser_id}): {e}"
-                )
-                results.append(
-                    {
-                        "advertiser_id": advertiser_id,
-                        "report_type": report_type,
-                        "destination_table": destination_table,
-                        "inserted_rows": 0,
-                        "status": "error",
-                        "error": str(e),
-                    }
-                )
+    if usage:
+        run_at = datetime.utcnow().isoformat()
+        try:
+            bq.record_metric_usage(
+                usage_table,
+                [{**row, "request_id": request_id, "run_at": run_at} for row in usage],
+            )
+        except Exception as e:
+            # o histórico só afeta a poda das próximas execuções
+            logger.warning(f"{request_id} - Falha ao gravar histórico de métricas: {e}")
 
     # Sumariza resultado
     total_inserted = sum(r.get("inserted_rows", 0) for r in results)
@@ -201,6 +526,48 @@ def run_extraction(payload: dict) -> dict:
     }
 
 
+def get_job_store() -> JobStore:
+    """Jobs assíncronos da instância, com estado persistido no BigQuery (JOBS_TABLE)."""
+    return registry.get(
+        "job_store",
+        "default",
+        lambda: JobStore(
+            save=lambda snapshot: get_bigquery(PROJECT_ID).save_job(JOBS_TABLE, snapshot),
+            load=lambda job_id: get_bigquery(PROJECT_ID).load_job(JOBS_TABLE, job_id),
+            stale_after=JOB_STALE_AFTER,
+        ),
+    )
+
+
+def get_job_executor() -> ThreadPoolExecutor:
+    """Executor dos jobs assíncronos (vive enquanto a instância estiver quente)."""
+    return registry.get(
+        "job_executor",
+        "default",
+        lambda: ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job"),
+    )
+
+
+def validate_payload(payload: dict) -> None:
+    """Validação feita antes de aceitar um job assíncrono (erros viram 400, não job falho)."""
+    get_required(payload, "access_token")
+    get_required(payload, "advertiser_ids")
+    report_mode = get_optional(payload, "report_mode", DEFAULT_REPORT_MODE)
+    if report_mode not in REPORT_MODES:
+        raise ValueError(f"report_mode inválido: {report_mode}. Use um de {REPORT_MODES}.")
+    MetricProfiles(get_optional(payload, "metric_profiles"))
+
+
+def run_job(job: Job, payload: dict) -> None:
+    """Executa a extração de um job em background, registrando o desfecho no job."""
+    job.start()
+    try:
+        job.finish(run_extraction(payload, job=job))
+    except Exception as e:
+        logger.exception(f"{job.job_id} - Job falhou: {e}")
+        job.fail(str(e))
+
+
 @app.get("/health")
 def health():
     """Endpoint de health check."""
@@ -211,8 +578,23 @@ def health():
 def run():
     """Endpoint principal para execução da extração."""
     payload = request.get_json(silent=True) or {}
+    async_mode = request.args.get("async", "").lower() in ("1", "true", "yes")
 
     try:
+        if async_mode:
+            # responde na hora; a extração segue em background e é acompanhada em /jobs/<id>
+            validate_payload(payload)
+            job = get_job_store().create()
+            get_job_executor().submit(run_job, job, payload)
+            logger.info(f"{job.job_id} - Job assíncrono aceito")
+            response = jsonify({
+                "status": "Accepted",
+                "job_id": job.job_id,
+                "status_url": f"/jobs/{job.job_id}",
+            })
+            response.headers["Location"] = f"/jobs/{job.job_id}"
+            return response, 202
+
         result = run_extraction(payload)
         status_code = 200 if result["status"] == "Ok" else 207
         return jsonify(result), status_code
@@ -226,6 +608,20 @@ def run():
         return jsonify({"status": "Error", "message": str(e)}), 500
 
 
+@app.get("/jobs/<job_id>")
+def get_job(job_id: str):
+    """Estado de um job assíncrono: status, progresso, results por unidade e tempos."""
+    try:
+        snapshot = get_job_store().get(job_id)
+    except Exception as e:
+        logger.exception(f"Erro ao consultar job {job_id}: {e}")
+        return jsonify({"status": "Error", "message": str(e)}), 500
+
+    if snapshot is None:
+        return jsonify({"status": "Error", "message": f"Job {job_id} não encontrado"}), 404
+    return jsonify(snapshot), 200
+
+
 def main():
     """Entry point para Cloud Run."""
     port = int(os.environ.get("PORT", "8080"))